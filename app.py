@@ -1,45 +1,45 @@
+from startup import get_timer
+startup = get_timer('app')  # プロセス開始 → 最初の描画 の区間を記録 (?debug=1 と標準エラーに表示)
+startup.mark('server')
 import streamlit as st
-import pandas as pd
 from datetime import datetime, timedelta, time, timezone
-import gspread
 import json
+import os
+from routine_layout import AUTO_SUPPLEMENTS, BEDTIME_SLIDE_TEXT, CSS, DONE_HTML, ITEMS_TEXT, ROUTINES, SKIPPED_HTML, TARGET_HTML
+from routine_log import BASE_COLUMNS, ROUTINE_KEYS, has_columns, migrate as migrate_routine_columns, progress_columns
+from sheets_io import get_pool as get_sheet_pool
+from debug_panel import debug_enabled, show_trace_panel, trace_session
+from storage import MemoryStore, MirroredStore, SheetsStore, SQLiteStore
+from tracing import get_tracer
+from write_queue import WriteQueue
+startup.mark('import')  # pandas / gspread はここでは読まない (復元・Sheets への書き込みで初めて import)
 
 # ==========================================
 # 🚀 1. ページ設定 & デザイン
 # ==========================================
 st.set_page_config(page_title="Phase 4 Dashboard v2.7", page_icon="⚡", layout="centered")
 
-st.markdown("""
-    <style>
-    .block-container { padding-top: 2rem; padding-bottom: 5rem; }
-    div.stButton > button {
-        width: 100%; background-color: #007AFF; color: white;
-        font-weight: bold; border-radius: 10px; padding: 0.5rem 1rem; border: none;
-    }
-    div.stButton > button:hover { background-color: #0056b3; color: white; }
-    </style>
-""", unsafe_allow_html=True)
+st.markdown(CSS, unsafe_allow_html=True)
+trace_session()  # このセッションの Sheets 呼び出しに ID を付ける (?debug=1 で表示)
 
 # ==========================================
 # ⚙️ 設定エリア
 # ==========================================
-SPREADSHEET_NAME = 'Phase4_Log' 
+SPREADSHEET_NAME = 'Phase4_Log'  # Secrets に spreadsheet_key があればキーで開く (名前検索は不要)
 WORKSHEET_NAME = 'v2'          
 MEAL_WORKSHEET_NAME = 'mealrecord' 
 JST = timezone(timedelta(hours=+9), 'JST')
-
-AUTO_SUPPLEMENTS = """MCTオイル 7g
-• カルニチン 4錠
-• タケダVitC 9錠
-• QPコーワα 1錠
-• ビタミンD 1錠
-• エビオス 30錠
-• ビオスリー 6錠
-• thoren Stress B complex 2錠
-• ビオチン 2錠
-• QPコーワヒーリング2錠
-• マグネシウム2錠
-• テアニン1錠"""
+WRITE_MODE = 'diff'  # STORAGE = 'sheets' / SAVE_MODE = 'direct' の時 — 'batch': 1行を1回の範囲更新で保存 / 'diff': 前回同期から変わった列だけ送る
+STORAGE = 'sqlite'  # 'sqlite': ローカルの SQLite に保存して Sheets へは非同期ミラー / 'memory': メモリ上 (オフライン確認用) / 'sheets': Sheets を直接読み書き
+SAVE_MODE = 'queue'  # STORAGE = 'sheets' の時 — 'queue': ローカルキューに記録してバックグラウンドで同期 / 'direct': その場で Sheets に書き込む
+ROUTINE_STORAGE = 'columns'  # 'columns': Progress JSON に加えて J〜R 列にルーティーンごとの時刻も保存 / 'json': Progress JSON だけ
+QUEUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pending_writes.sqlite3')
+STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local_store.sqlite3')  # sleep_app.py と共通
+RESTORE_TAIL_ROWS = 60  # 起動時の復元で読むシート末尾の行数
+RESTORE_CACHE_TTL = 300  # STORAGE = 'sheets' の時、復元用に読んだシート末尾のキャッシュ秒数 (全セッション共有)
+TRACE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'trace.jsonl')  # Sheets 呼び出しの記録 (JSONL)
+TRACE_CSV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'trace.csv')
+# ルーティーンの項目・自動付与のサプリメント (AUTO_SUPPLEMENTS) は routine_layout.py
 
 def get_now_jst(): return datetime.now(JST)
 def get_today_str(): return get_now_jst().strftime('%Y-%m-%d')
@@ -47,137 +47,200 @@ def get_today_str(): return get_now_jst().strftime('%Y-%m-%d')
 # ==========================================
 # 🛠 接続 & 同期関数
 # ==========================================
-@st.cache_resource
-def get_gc():
+def get_pool():
     try:
         if "gcp_json" not in st.secrets:
             st.error("Secretsに 'gcp_json' が見つかりません。")
             return None
-        raw_json = st.secrets["gcp_json"].strip().replace('\\', '\\\\').replace('\\\\n', '\\n')
-        creds_dict = json.loads(raw_json, strict=False)
-        if "private_key" in creds_dict:
-            creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n").strip()
-        return gspread.service_account_from_dict(creds_dict)
+        # クライアント・ハンドルは sheets_io 側でプロセス内共有 (sleep_app.py とも共通)
+        return get_sheet_pool(st.secrets["gcp_json"], st.secrets.get("spreadsheet_key"), SPREADSHEET_NAME, get_tracer(TRACE_PATH))
     except Exception as e:
         st.error(f"GCP Connection Error: {e}"); return None
 
 def get_worksheet(name):
-    gc = get_gc()
-    if gc:
-        try: return gc.open(SPREADSHEET_NAME).worksheet(name)
+    pool = get_pool()
+    if pool:
+        try: return pool.sheet(name)
         except Exception as e: st.error(f"Worksheet Error ({name}): {e}"); return None
     return None
 
-def sync_meal_data():
-    sheet = get_worksheet(MEAL_WORKSHEET_NAME)
+def restore_rows(name):
+    # 復元用の [header, *末尾 RESTORE_TAIL_ROWS 行] (Sheets が保存先なら、未同期の保存はそちらを優先して重ねてある)
+    try: return get_store().recent(name, RESTORE_TAIL_ROWS)
+    except Exception as e: st.error(f"Worksheet Error ({name}): {e}"); return []
+
+def routine_columns_ready():
+    # J〜R 列に書くのは v2 のヘッダーが展開済みの時だけ (展開前の J〜R 列にあるデータを上書きしない)
+    return ROUTINE_STORAGE == 'columns' and has_columns(st.session_state.get('routine_header') or ())
+
+def run_routine_migration():
+    # 既存の行の Progress JSON を J〜R 列に展開する (ボタンから明示的に実行。J〜R 列が空でなければ何も書かずに中止)
+    sheet = get_worksheet(WORKSHEET_NAME)
     if not sheet: return
+    try: n = migrate_routine_columns(sheet)
+    except Exception as e: st.error(f"ルーティーン列の展開を中止しました: {e}"); return
+    header = (list(st.session_state.get('routine_header') or []) + [""] * BASE_COLUMNS)[:BASE_COLUMNS] + ROUTINE_KEYS
+    get_pool().index(WORKSHEET_NAME).invalidate()
+    get_store().seed(WORKSHEET_NAME, header, [])  # 保存先に展開後のヘッダーを覚えさせる
+    st.session_state['routine_header'] = tuple(header)
+    st.success(f"✅ {n} 行の Progress をルーティーンごとの列 (J〜R) に展開しました")
 
-    with st.spinner("Saving Meal Record..."):
-        today_str = get_today_str()
-        
-        # 書き込むデータ（A列〜E列の5つ）
-        meal_row = [
-            today_str,
-            st.session_state.get('meal_breakfast', ""),
-            st.session_state.get('meal_lunch', ""),
-            st.session_state.get('meal_dinner', ""),
-            AUTO_SUPPLEMENTS
-        ]
+@st.cache_resource
+def get_write_queue():
+    return WriteQueue(QUEUE_PATH)
 
-        try:
-            # 1. A列（日付）を全部読み込む
-            dates = sheet.col_values(1) 
-            
-            if today_str in dates:
-                # 【上書きモード】既に今日の日付がある場合
-                idx = dates.index(today_str) + 1
-                # 範囲指定で強制書き込み (A〜E列)
-                sheet.update(range_name=f'A{idx}:E{idx}', values=[meal_row])
-                st.success(f"✅ mealrecord 更新完了 ({today_str})")
-            else:
-                # 【新規モード】今日の日付がない場合
-                # append_row は使わず、行番号を計算して強制書き込み
-                # これで右側に何があってもズレずにA列から書けます
-                next_row = len(dates) + 1
-                sheet.update(range_name=f'A{next_row}:E{next_row}', values=[meal_row])
-                st.success(f"✅ mealrecord 新規保存完了 ({today_str})")
+@st.cache_resource
+def get_store():
+    # 保存先はプロセスに1つ (sleep_app.py と同じ構成)。保存・復元はすべてここを通す
+    # sqlite / memory: ローカルを正にして Sheets には get_write_queue のキュー経由でミラー (まだローカルにないシートは最初に1回取り込む)
+    # sheets: Sheets を直接読み書き (SAVE_MODE = 'queue' ならキュー経由で書く)
+    if STORAGE == 'sheets':
+        pool = get_pool()
+        if pool is None: raise RuntimeError("シートに接続できません。")
+        return SheetsStore(pool, get_write_queue() if SAVE_MODE == 'queue' else None, WRITE_MODE, RESTORE_CACHE_TTL)
+    local = SQLiteStore(STORE_PATH) if STORAGE == 'sqlite' else MemoryStore()
+    return MirroredStore(local, get_write_queue(), get_pool())
+
+@st.fragment(run_every=2)
+def flush_calls(name, date, rev):
+    # この保存の行が Sheets に届いたら、それを送った同期の API 呼び出し回数を出す (届くまでこのフラグメントだけ2秒ごとに見直す)
+    calls = get_write_queue().synced_calls(name, date, rev)
+    st.caption(f"API calls: {calls} (この保存を送った同期)" if calls is not None else "API calls: 同期待ち…")
 
+def save_row(name, row, value_input_option="RAW"):
+    # 保存先に date で upsert する。キュー経由ならすぐ戻り、Sheets へはバックグラウンドで日付ごとに upsert
+    with st.spinner("Saving..."):
+        try:
+            store = get_store()
+            calls = store.upsert(name, row, value_input_option)
         except Exception as e:
-            st.error(f"Meal Sync Error: {e}")
+            st.error(f"Sync Error ({name}): {e}"); return
+    date = str(row[0])
+    if store.queue is None:
+        st.success(f"✅ 保存しました ({name} / {date})")
+        st.caption(f"API calls: {calls}")
+        return
+    count, err = store.mirror_stats()
+    st.success(f"✅ 保存しました ({name} / 未同期 {count} 件はバックグラウンドで送信)")
+    rev = store.queue.rev(name, date)
+    if store.pool is not None and rev: flush_calls(name, date, rev)
+    if err: st.caption(f"⚠️ 前回の同期エラー (自動で再送します): {err}")
+
+def sync_meal_data():
+    today_str = get_today_str()
+    
+    # 書き込むデータ（A列〜E列の5つ）
+    meal_row = [
+        today_str,
+        st.session_state.get('meal_breakfast', ""),
+        st.session_state.get('meal_lunch', ""),
+        st.session_state.get('meal_dinner', ""),
+        AUTO_SUPPLEMENTS
+    ]
+    save_row(MEAL_WORKSHEET_NAME, meal_row)
 
 def sync_button(key):
     if st.button("🔄 全データを同期 (Save to Drive)", type="primary", use_container_width=True, key=key):
-        sheet = get_worksheet(WORKSHEET_NAME)
-        if not sheet: st.error("シートに接続できません。")
-        else:
-            with st.spinner("Saving..."):
-                progress_dict = {}
-                keys = ["morning_ignition", "morning_muscle", "morning_walk", "morning_breakfast", "lunch", "evening_pre_workout", "evening_workout", "dinner_after", "bedtime_routine"]
-                for k in keys:
-                    if st.session_state.get(f"{k}_done", False): progress_dict[k] = st.session_state.get(f"{k}_time", "")
-                    elif st.session_state.get(f"{k}_skipped", False): progress_dict[k] = "SKIPPED"
-                
-                today_str = get_today_str()
-                row_data = [
-                    today_str, 
-                    st.session_state['wake_up_time'].strftime('%H:%M:%S'), 
-                    st.session_state['workout_type'], 
-                    0, "", 
-                    st.session_state['workout_time'].strftime('%H:%M:%S'), 
-                    st.session_state['bed_time'].strftime('%H:%M:%S'),
-                    json.dumps(progress_dict, ensure_ascii=False),
-                    st.session_state['diary_text']
-                ]
-                try:
-                    dates = sheet.col_values(1)
-                    if today_str in dates:
-                        idx = dates.index(today_str) + 1
-                        for i, val in enumerate(row_data): sheet.update_cell(idx, i+1, val)
-                        st.success("✅ 同期完了")
-                    else:
-                        sheet.append_row(row_data)
-                        st.success("✅ 新規保存完了")
-                except Exception as e: st.error(f"Error: {e}")
-
-def routine_block(title, items, key_prefix, target_time_str=None, default_time_val=None, can_skip=False):
+        progress_dict = {}
+        for k in ROUTINE_KEYS:
+            if st.session_state.get(f"{k}_done", False): progress_dict[k] = st.session_state.get(f"{k}_time", "")
+            elif st.session_state.get(f"{k}_skipped", False): progress_dict[k] = "SKIPPED"
+        
+        today_str = get_today_str()
+        row_data = [
+            today_str, 
+            st.session_state['wake_up_time'].strftime('%H:%M:%S'), 
+            st.session_state['workout_type'], 
+            0, "", 
+            st.session_state['workout_time'].strftime('%H:%M:%S'), 
+            st.session_state['bed_time'].strftime('%H:%M:%S'),
+            json.dumps(progress_dict, ensure_ascii=False),
+            st.session_state['diary_text']
+        ]
+        if routine_columns_ready(): row_data += progress_columns(progress_dict)  # J〜R 列: ルーティーンごとの時刻
+        # update_cell と同じく USER_ENTERED で書き込む (時刻などをシート側で解釈させる)
+        save_row(WORKSHEET_NAME, row_data, "USER_ENTERED")
+
+def complete_routine(key_prefix):
+    # ボタンの on_click で呼ぶ (st.rerun せずに、押したブロックのフラグメントだけが描き直される)
+    st.session_state[f"{key_prefix}_done"] = True
+    st.session_state[f"{key_prefix}_time"] = st.session_state[f"{key_prefix}_picker"].strftime('%H:%M')
+
+def skip_routine(key_prefix):
+    st.session_state[f"{key_prefix}_skipped"] = True
+    if key_prefix == "evening_workout": st.session_state["evening_pre_workout_skipped"] = True
+
+def set_state(key, value): st.session_state[key] = value
+
+def routine_block(key_prefix, target_time_str=None, default_time_val=None, can_skip=False, title=None, items_text=None):
+    # 静的な部分 (タイトル・項目) は routine_layout で作り済み。状態の変更は on_click のコールバックで行う
     done_key, time_key, skipped_key, picker_key = f"{key_prefix}_done", f"{key_prefix}_time", f"{key_prefix}_skipped", f"{key_prefix}_picker"
     if done_key not in st.session_state: st.session_state[done_key] = False
     if skipped_key not in st.session_state: st.session_state[skipped_key] = False
+    title = title or ROUTINES[key_prefix][0]
 
     if st.session_state[done_key]:
         with st.container(border=False):
-            st.markdown(f'<div style="background-color: #f0f2f6; padding: 10px; border-radius: 10px; color: gray;"><h4 style="margin:0; text-decoration: line-through;">{title.split("<")[0].strip()}</h4><small>✅ Completed at {st.session_state[time_key]}</small></div>', unsafe_allow_html=True)
-            if st.button("↺ 修正", key=f"{key_prefix}_undo"):
-                st.session_state[done_key] = False; st.rerun()
+            st.markdown(DONE_HTML.format(title=title, at=st.session_state[time_key]), unsafe_allow_html=True)
+            st.button("↺ 修正", key=f"{key_prefix}_undo", on_click=set_state, args=(done_key, False))
         return st.session_state.get(time_key, "07:00")
     elif st.session_state[skipped_key]:
         with st.container(border=False):
-            st.markdown(f'<div style="background-color: #e0e0e0; padding: 10px; border-radius: 10px; color: #9e9e9e;"><h4 style="margin:0;">{title.split("<")[0].strip()}</h4><small>⚠️ Skipped (Rest Day)</small></div>', unsafe_allow_html=True)
-            if st.button("↺ 修正して実行", key=f"{key_prefix}_unskip"):
-                st.session_state[skipped_key] = False; st.rerun()
+            st.markdown(SKIPPED_HTML.format(title=title), unsafe_allow_html=True)
+            st.button("↺ 修正して実行", key=f"{key_prefix}_unskip", on_click=set_state, args=(skipped_key, False))
         return "SKIPPED"
     else:
         with st.container(border=True):
-            display_title = title if not target_time_str else f"{title} <span style='color:#FF4B4B; font-size:0.85em;'>({target_time_str})</span>"
-            st.markdown(f"### {display_title}", unsafe_allow_html=True)
-            for item in items: st.text(f"• {item}")
+            st.markdown(TARGET_HTML.format(title=title, target=target_time_str) if target_time_str else f"### {title}", unsafe_allow_html=True)
+            st.text(items_text or ITEMS_TEXT[key_prefix])
             st.markdown("---")
             cols = st.columns([1, 1, 1]) if can_skip else st.columns([1, 1])
             with cols[0]:
-                input_time = st.time_input("実施時間", value=st.session_state.get(picker_key, default_time_val or time(7, 0)), key=picker_key)
+                st.time_input("実施時間", value=st.session_state.get(picker_key, default_time_val or ROUTINES[key_prefix][2] or time(7, 0)), key=picker_key)
             with cols[1]:
                 st.write(""); st.write("")
-                if st.button("✅ 完了", key=f"{key_prefix}_btn", type="primary", use_container_width=True):
-                    st.session_state[done_key], st.session_state[time_key] = True, input_time.strftime('%H:%M'); st.rerun()
+                st.button("✅ 完了", key=f"{key_prefix}_btn", type="primary", use_container_width=True, on_click=complete_routine, args=(key_prefix,))
             if can_skip:
                 with cols[2]:
                     st.write(""); st.write("")
-                    if st.button("❌ やらない", key=f"{key_prefix}_skip", use_container_width=True):
-                        st.session_state[skipped_key] = True
-                        if key_prefix == "evening_workout": st.session_state["evening_pre_workout_skipped"] = True
-                        st.rerun()
+                    st.button("❌ やらない", key=f"{key_prefix}_skip", use_container_width=True, on_click=skip_routine, args=(key_prefix,))
         return st.session_state.get(time_key, "07:00")
 
+# 他のブロックに影響しないブロックは、それぞれ1つのフラグメントとして描く (操作してもそのブロックだけ再実行)
+routine_fragment = st.fragment(routine_block)
+
+@st.fragment
+def morning_start_fragment(today_date):
+    # 2. の開始目安は 1. の完了時刻から決まるので、1. と 2. は同じフラグメントで描き直す
+    ign_time = routine_block("morning_ignition")
+    try:
+        target_m = datetime.combine(today_date, datetime.strptime(ign_time, '%H:%M').time()) + timedelta(minutes=30)
+        target_m_str, target_m_val = target_m.strftime('%H:%M'), target_m.time()
+    except ValueError:
+        target_m_str, target_m_val = "--:--", None
+    routine_block("morning_muscle", f"{target_m_str} Start", default_time_val=target_m_val)
+
+@st.fragment
+def evening_night_fragment(today_date):
+    # 7. を「やらない」にすると 6. と 9. の表示も変わるので、夕方〜夜のブロックは1つのフラグメントにまとめる
+    workout_type = st.session_state['workout_type']
+    if "なし" not in workout_type:
+        st.markdown("### 🌆 Evening (Extra Burn)")
+        w_time = st.session_state['workout_time']
+        pre_w_val = (datetime.combine(today_date, w_time) - timedelta(minutes=30)).time()
+        routine_block("evening_pre_workout", pre_w_val.strftime('%H:%M'), default_time_val=pre_w_val, title=ROUTINES["evening_pre_workout"][0].format(workout=workout_type))
+        routine_block("evening_workout", w_time.strftime('%H:%M'), default_time_val=w_time, can_skip=True, title=ROUTINES["evening_workout"][0].format(workout=workout_type))
+
+    st.markdown("### 🌙 Night & Recovery")
+    routine_block("dinner_after")
+
+    bed_dt = datetime.combine(today_date, st.session_state['bed_time'])
+    bath_val = (bed_dt - timedelta(minutes=90)).time()
+    supple_val = (bed_dt - timedelta(minutes=50)).time()
+    target_label = f"入浴目安: {bath_val.strftime('%H:%M')} / 摂取目標: {supple_val.strftime('%H:%M')}"
+    slide = "なし" in workout_type or st.session_state.get("evening_workout_skipped", False)
+    routine_block("bedtime_routine", target_label, default_time_val=bath_val, items_text=BEDTIME_SLIDE_TEXT if slide else None)
+
 # ==========================================
 # 📥 データ読み込み & 初期化 (リロード復旧)
 # ==========================================
@@ -195,47 +258,52 @@ if 'init_done' not in st.session_state:
     st.session_state['meal_dinner'] = ""
 
 if not st.session_state['init_done']:
-    # 1. ルーティーン読込
-    sheet = get_worksheet(WORKSHEET_NAME)
-    if sheet:
-        try:
-            raw_routine = sheet.get_all_values()
-            if len(raw_routine) > 1:
-                headers = [h if (h and h.strip()) else f"COL_{i}" for i, h in enumerate(raw_routine[0])]
-                df = pd.DataFrame(raw_routine[1:], columns=headers)
-                if 'Date' in df.columns:
-                    today_data = df[df['Date'] == today_str]
-                    if not today_data.empty:
-                        row = today_data.iloc[0]
-                        st.session_state['wake_up_time'] = datetime.strptime(str(row['WakeTime']), '%H:%M:%S').time()
-                        st.session_state['workout_type'] = str(row['Workout'])
-                        st.session_state['workout_time'] = datetime.strptime(str(row['WorkoutTime']), '%H:%M:%S').time()
-                        st.session_state['bed_time'] = datetime.strptime(str(row['BedTime']), '%H:%M:%S').time()
-                        st.session_state['diary_text'] = str(row.get('Diary', ""))
-                        progress = json.loads(str(row['Progress']))
-                        for key, val in progress.items():
-                            if val == "SKIPPED": st.session_state[f"{key}_skipped"] = True
-                            else: st.session_state[f"{key}_done"], st.session_state[f"{key}_time"] = True, val
-        except: pass
+    import pandas as pd  # 復元にだけ使う (2回目以降の実行・他のセッションでは import 済み)
+    # 1. ルーティーン読込 (シート末尾だけ / セッション間でキャッシュ共有)
+    raw_routine = []
+    try:
+        raw_routine = restore_rows(WORKSHEET_NAME)
+        if len(raw_routine) > 1:
+            headers = [h if (h and h.strip()) else f"COL_{i}" for i, h in enumerate(raw_routine[0])]
+            df = pd.DataFrame(raw_routine[1:], columns=headers)
+            if 'Date' in df.columns:
+                today_data = df[df['Date'] == today_str]
+                if not today_data.empty:
+                    row = today_data.iloc[0]
+                    st.session_state['wake_up_time'] = datetime.strptime(str(row['WakeTime']), '%H:%M:%S').time()
+                    st.session_state['workout_type'] = str(row['Workout'])
+                    st.session_state['workout_time'] = datetime.strptime(str(row['WorkoutTime']), '%H:%M:%S').time()
+                    st.session_state['bed_time'] = datetime.strptime(str(row['BedTime']), '%H:%M:%S').time()
+                    st.session_state['diary_text'] = str(row.get('Diary', ""))
+                    progress = json.loads(str(row['Progress']))
+                    for key, val in progress.items():
+                        if val == "SKIPPED": st.session_state[f"{key}_skipped"] = True
+                        else: st.session_state[f"{key}_done"], st.session_state[f"{key}_time"] = True, val
+    except: pass
     
+    # J〜R 列への展開は下の「ルーティーン列の準備」から明示的に行う (ここではヘッダーを覚えるだけ)
+    # 覚えるのは Sheets から読んだヘッダー (展開ボタンで書いたものを含む) だけ。ローカルの既定のヘッダーでは J〜R 列に書かない
+    st.session_state['routine_header'] = tuple(raw_routine[0]) if raw_routine and get_store().has(WORKSHEET_NAME) else ()
+
     # 2. 食事記録読込
-    m_sheet = get_worksheet(MEAL_WORKSHEET_NAME)
-    if m_sheet:
-        try:
-            raw_m = m_sheet.get_all_values()
-            if len(raw_m) > 1:
-                headers_m = [h if (h and h.strip()) else f"COL_{i}" for i, h in enumerate(raw_m[0])]
-                m_df = pd.DataFrame(raw_m[1:], columns=headers_m)
-                if 'DATE' in m_df.columns:
-                    target_row = m_df[m_df['DATE'].astype(str) == today_str]
-                    if not target_row.empty:
-                        m_row = target_row.iloc[0]
-                        st.session_state['meal_breakfast'] = str(m_row.get('BREAKFAST', ""))
-                        st.session_state['meal_lunch'] = str(m_row.get('LUNCH', ""))
-                        st.session_state['meal_dinner'] = str(m_row.get('DINNER', ""))
-                        st.toast(f"✅ {today_str} の食事を復元しました")
-        except: pass
+    try:
+        raw_m = restore_rows(MEAL_WORKSHEET_NAME)
+        if len(raw_m) > 1:
+            headers_m = [h if (h and h.strip()) else f"COL_{i}" for i, h in enumerate(raw_m[0])]
+            m_df = pd.DataFrame(raw_m[1:], columns=headers_m)
+            if 'DATE' in m_df.columns:
+                target_row = m_df[m_df['DATE'].astype(str) == today_str]
+                if not target_row.empty:
+                    m_row = target_row.iloc[0]
+                    st.session_state['meal_breakfast'] = str(m_row.get('BREAKFAST', ""))
+                    st.session_state['meal_lunch'] = str(m_row.get('LUNCH', ""))
+                    st.session_state['meal_dinner'] = str(m_row.get('DINNER', ""))
+                    st.toast(f"✅ {today_str} の食事を復元しました")
+    except: pass
+    try: get_store().resume_sync()  # 前回のプロセスで残った未同期分も送り始める
+    except Exception: pass  # 接続できないことは復元のところで表示済み
     st.session_state['init_done'] = True
+    startup.mark('restore')
 
 # ==========================================
 # 🖥 メインUI
@@ -276,43 +344,24 @@ with st.expander("🍴 食事記録 (mealrecord)", expanded=False):
 # --- タイムライン ---
 st.markdown("### 🌅 Morning")
 today_date = get_now_jst().date()
-ign_time = routine_block("1. 爆速点火フェーズ", ["MCTオイル 7g", "マグネシウム 2錠", "クルクミン 2錠", "カルニチン 2錠", "NAC 1錠", "R-リポ 1錠", "タケダVitC 3錠", "QPコーワα 1錠", "ビタミンD 1錠"], "morning_ignition", default_time_val=time(7, 15))
-
-try:
-    ig_dt = datetime.combine(today_date, datetime.strptime(ign_time, '%H:%M').time())
-    target_m_str = (ig_dt + timedelta(minutes=30)).strftime('%H:%M'); target_m_val = (ig_dt + timedelta(minutes=30)).time()
-except:
-    target_m_str = "--:--"; target_m_val = time(7, 45)
-
-routine_block("2. 筋肉起動 & 温冷浴", ["ヨガ・プランク2分・スクワット10", "温水3分 ➡ 冷水1分"], "morning_muscle", f"{target_m_str} Start", default_time_val=target_m_val)
-routine_block("3. 朝散歩", ["外気浴 15-20分"], "morning_walk", default_time_val=time(8, 0))
-routine_block("4. 朝食 & サプリ", ["ベースブレッド 1個", "エビオス 10錠", "ビオスリー 2錠", "Stress B 1錠", "Omega3 2錠", "ビオチン 2錠"], "morning_breakfast", default_time_val=time(8, 30))
+morning_start_fragment(today_date)
+routine_fragment("morning_walk")
+routine_fragment("morning_breakfast")
 
 st.markdown("### ☀️ Lunch")
-routine_block("5. 昼食 (代謝維持)", ["ベースブレッド", "エビオス 10錠", "ビオスリー 2錠", "タケダVitC 3錠"], "lunch", default_time_val=time(12, 0))
+routine_fragment("lunch")
 
-workout_type = st.session_state['workout_type']
-if "なし" not in workout_type:
-    st.markdown("### 🌆 Evening (Extra Burn)")
-    w_time = st.session_state['workout_time']
-    pre_w_val = (datetime.combine(today_date, w_time) - timedelta(minutes=30)).time()
-    routine_block(f"6. 運動前準備 ({workout_type})", ["カルニチン 2錠 (30分前)"], "evening_pre_workout", pre_w_val.strftime('%H:%M'), default_time_val=pre_w_val)
-    routine_block(f"7. ガチ運動 ({workout_type})", ["心拍数管理", "水分補給"], "evening_workout", w_time.strftime('%H:%M'), default_time_val=w_time, can_skip=True)
-
-st.markdown("### 🌙 Night & Recovery")
-routine_block("8. 夕食後", ["ご飯 MAX 120g", "エビオス 10錠", "ビオスリー 2錠", "V-E400 1錠", "Omega3 2錠", "Stress B 1錠"], "dinner_after", default_time_val=time(19, 0))
-
-bed_dt = datetime.combine(today_date, st.session_state['bed_time'])
-bath_val = (bed_dt - timedelta(minutes=90)).time()
-supple_val = (bed_dt - timedelta(minutes=50)).time()
-target_label = f"入浴目安: {bath_val.strftime('%H:%M')} / 摂取目標: {supple_val.strftime('%H:%M')}"
-
-bed_items = ["お風呂 15分 (40℃)", "QPコーワヒーリング 2錠", "亜鉛 1錠", "マグネシウム 2錠", "( 運動した日はクルクミン 2錠 )", "テアニン 1錠", "タケダVitC 3錠"]
-if "なし" in workout_type or st.session_state.get("evening_workout_skipped", False):
-    bed_items.append("💊 カルニチン 2錠 (夕方分スライド)")
-routine_block("9. 究極回復セット", bed_items, "bedtime_routine", target_label, default_time_val=bath_val)
+evening_night_fragment(today_date)
 
 st.markdown("### 📝 Diary")
 st.session_state['diary_text'] = st.text_area("今日の振り返り・メモ", value=st.session_state.get('diary_text', ""), height=150)
 st.markdown("---")
-sync_button("bottom_sync")
\ No newline at end of file
+sync_button("bottom_sync")
+
+if ROUTINE_STORAGE == 'columns' and not routine_columns_ready():
+    with st.expander("📦 ルーティーン列 (J〜R) の準備"):
+        st.caption("v2 の Progress JSON をルーティーンごとの列 (J〜R) に展開します。展開するまでは Progress JSON だけに保存します (J〜R 列にデータがある時は何も書かずに中止)")
+        if st.button("📦 J〜R 列に展開する", use_container_width=True): run_routine_migration()
+
+startup.finish(get_tracer(TRACE_PATH))
+if debug_enabled(): show_trace_panel(get_tracer(TRACE_PATH), TRACE_CSV_PATH, startup)
@@ -0,0 +1,340 @@
+"""
+オフラインのベンチマーク (ネットワーク・認証情報なし)
+fakes の偽 Google Sheets (1回ごとの遅延・クォータエラーを再現) を使って、実際の app.py を Streamlit の AppTest で動かし、
+起動時の復元 / sync_button (新規・上書き) / sync_meal_data の
+  API 呼び出し回数・画面が戻るまでの時間・Sheets に届くまでの時間・メモリのピーク
+をシートの行数 (100〜100k) と保存方式 (STORAGE / SAVE_MODE) ごとに測る。
+画像解析は sleep_app.py と同じ sleep_extract の経路 (全枚数を1回 / 1枚ずつ並列 + キャッシュ / 聞き直し) を StubModel で測る。
+起動時間は app.py / sleep_app.py を新しいプロセスで1回ずつ動かし、startup の区間と最初の描画までに import された重いモジュールを出す。
+
+    python bench.py                                  # 100, 1k, 10k, 100k 行 × 3方式 + 画像解析
+    python bench.py --rows 100 1000 --latency 0.05 --fail-every 7
+    python bench.py --json bench.json                # 結果を保存
+    python bench.py --baseline bench.json            # API 呼び出し回数が基準より増えていたら終了コード 1
+    python bench.py --rows 100 --images 1 --cold-start-only   # 起動時間だけ
+"""
+import argparse
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import date, timedelta
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, APP_DIR)
+
+import streamlit as st
+from PIL import Image, ImageDraw
+from streamlit.testing.v1 import AppTest
+
+from fakes import FakeClient, StubModel
+from routine_log import ROUTINE_KEYS
+from sheets_io import use_client_factory
+from sleep_extract import extract_record
+from sleep_vision import SLEEP_FIELDS, ResultCache, preprocess_image
+from storage import DEFAULT_HEADERS
+
+# 名前 → (STORAGE, SAVE_MODE)
+MODES = {
+    "sqlite": ("sqlite", "queue"),
+    "sheets-queue": ("sheets", "queue"),
+    "sheets-direct": ("sheets", "direct"),
+}
+DIARY_LABEL = "今日の振り返り・メモ"
+HEAVY_MODULES = ("pandas", "gspread", "google.generativeai", "PIL")  # 最初の描画までに import されていないことを確かめる
+MEAL_BUTTON = "🔄 食事記録を同期"
+
+
+# --- 偽データ ---
+def make_sheets(n, today):
+    """今日の前日までの n 日分の行を持つ v2 (J〜R 列は展開済み) / mealrecord / SleepLog"""
+    days = [(today - timedelta(days=n - i)).isoformat() for i in range(n)]
+    routine = [[d, "07:00:00", "なし", "0", "", "18:00:00", "23:30:00", "{}", ""] + [""] * 9 for d in days]
+    meal = [[d, "ベースブレッド", "", "", "MCTオイル 7g"] for d in days]
+    sleep = [[d, "80", "7:00", "23:30", "6:30", "1:30", "4:00", "1:30", "55", "48", "90", "50"] for d in days]
+    return {
+        "v2": [DEFAULT_HEADERS["v2"] + ROUTINE_KEYS] + routine,
+        "mealrecord": [DEFAULT_HEADERS["mealrecord"]] + meal,
+        "SleepLog": [DEFAULT_HEADERS["SleepLog"]] + sleep,
+    }
+
+
+def patched_app(storage, save_mode):
+    """STORAGE / SAVE_MODE だけを書き換えた app.py のソース"""
+    with open(os.path.join(APP_DIR, "app.py"), encoding="utf-8") as fp:
+        src = fp.read()
+    src = re.sub(r"^STORAGE = '\w+'", f"STORAGE = '{storage}'", src, count=1, flags=re.M)
+    return re.sub(r"^SAVE_MODE = '\w+'", f"SAVE_MODE = '{save_mode}'", src, count=1, flags=re.M)
+
+
+# --- 計測 ---
+def _calls(client):
+    return {title: len(ws.log) for title, ws in client.worksheets.items()}
+
+
+def measure(client, action, synced=None, timeout=60.0):
+    """
+    action() を実行して、画面が戻るまでの時間と、synced() が真になる (Sheets に届く) までの時間・
+    その間の API 呼び出し (シートごとの log の増分)・メモリのピーク を返す
+    """
+    before = _calls(client)
+    if tracemalloc.is_tracing(): tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    error = action()
+    ui = time.perf_counter() - t0
+    ui_calls = sum(_calls(client).values()) - sum(before.values())
+    deadline = time.monotonic() + timeout
+    while synced is not None and error is None and not synced() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    done = time.perf_counter() - t0
+    if synced is not None and not synced(): error = error or "timeout"
+    time.sleep(0.05)  # 届いた直後の呼び出しも数える
+    ops = Counter()
+    for title, ws in client.worksheets.items():
+        ops.update(f"{title}.{op}" for op in ws.log[before[title]:])
+    return {
+        "ui_ms": round(ui * 1000, 1), "synced_ms": round(done * 1000, 1),
+        "ui_calls": ui_calls, "calls": sum(ops.values()), "ops": dict(ops),
+        "peak_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if tracemalloc.is_tracing() else None,
+        "error": error,
+    }
+
+
+def _has(ws, marker):
+    return any(marker in str(c) for r in ws.data[-3:] for c in r)
+
+
+def run_app(mode, n, latency, fail_every, timeout):
+    storage, save_mode = MODES[mode]
+    client = FakeClient(make_sheets(n, date.today()), latency=latency, fail_every=fail_every)
+    use_client_factory(lambda creds: client)
+    st.cache_data.clear(); st.cache_resource.clear()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # 保存先・キュー・トレースのファイルは app.py の隣に作られるので、シナリオごとの一時フォルダで動かす
+        script = os.path.join(tmp, "app.py")
+        with open(script, "w", encoding="utf-8") as fp:
+            fp.write(patched_app(storage, save_mode))
+        at = AppTest.from_file(script, default_timeout=timeout)
+        at.secrets["gcp_json"] = "{}"
+        at.secrets["spreadsheet_key"] = FakeClient.KEY
+
+        def run(step):
+            def action():
+                step()
+                at.run()
+                return str(at.exception[0].value)[:200] if at.exception else ("; ".join(e.value for e in at.error) or None)
+            return action
+
+        results["startup"] = measure(client, run(lambda: None), timeout=timeout)
+        for phase in ("sync_append", "sync_update"):
+            marker = f"bench-{phase}"
+            # 日記は画面の下にあるので、入力を反映させる実行を挟んでから上の同期ボタンを押す (実際の操作と同じ順)
+            next(t for t in at.text_area if t.label == DIARY_LABEL).set_value(marker)
+            at.run()
+            results[phase] = measure(
+                client, run(lambda: at.button(key="top_sync").click()),
+                lambda: _has(client.worksheets["v2"], marker), timeout,
+            )
+        marker = "bench-meal"
+        results["sync_meal"] = measure(
+            client, run(lambda: (at.text_area(key="meal_breakfast").set_value(marker), next(b for b in at.button if b.label == MEAL_BUTTON).click())),
+            lambda: _has(client.worksheets["mealrecord"], marker), timeout,
+        )
+    use_client_factory(lambda creds: None)
+    return results
+
+
+# --- 画像解析 ---
+def screenshot(seed, size=(1170, 2532)):
+    """睡眠アプリのスクショっぽい画像 (上下に黒帯、中央にグラフと文字)"""
+    img = Image.new("RGB", size, (0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle([40, 300, size[0] - 40, size[1] - 300], fill=(18, 22, 40))
+    for i in range(60):
+        x = 80 + i * (size[0] - 160) // 60
+        h = 100 + (seed * 37 + i * 53) % 500
+        draw.rectangle([x, 1400 - h, x + 12, 1400], fill=(60 + i % 3 * 60, 90, 200))
+    for j in range(20):
+        draw.text((90, 1500 + j * 40), f"{seed:03d} 睡眠スコア {70 + j} 深い睡眠 1:{j:02d}", fill=(230, 230, 230))
+    noise = Image.effect_noise((size[0] - 80, 200), 40).convert("RGB")
+    img.paste(noise, (40, 320))
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+STUB_RECORD = {
+    "date": (date.today() - timedelta(days=1)).isoformat(), "sleep_score": 80, "total_sleep": "7:00", "fall_asleep": "23:30", "wake_up": "6:30",
+    "rem": "1:30", "light": "4:00", "deep": "1:30", "avg_hr": 60, "min_hr": 50, "max_hr": 90, "resting_hr": 55,
+}
+
+
+def stub_reply(parts):
+    # 1枚ずつの時は項目の一部だけを返す (部分的な結果を1レコードにまとめる処理も通す)
+    n = len(parts) - 1
+    fields = SLEEP_FIELDS if n > 1 else SLEEP_FIELDS[: 4 + n % 8]
+    return {f: STUB_RECORD[f] for f in fields}
+
+
+def stub_reply_needs_repair(parts):
+    # 最初は total_sleep を読み違える (ステージの合計と合わない) → 聞き直すと正しい値を返す
+    if "読み直して" in parts[0]:
+        return {"total_sleep": STUB_RECORD["total_sleep"]}
+    return {**STUB_RECORD, "total_sleep": "1:00"}
+
+
+def run_analyze(n_images, latency, workers):
+    raw = [screenshot(i) for i in range(n_images)]
+    results = {}
+
+    def timed(fn):
+        if tracemalloc.is_tracing(): tracemalloc.reset_peak()
+        t0 = time.perf_counter()
+        out = fn()
+        return out, {
+            "wall_ms": round((time.perf_counter() - t0) * 1000, 1),
+            "peak_mb": round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1) if tracemalloc.is_tracing() else None,
+        }
+
+    images, stats = timed(lambda: [preprocess_image(b) for b in raw])
+    results["preprocess"] = stats | {"bytes_in": sum(map(len, raw)), "bytes_out": sum(map(len, images))}
+
+    today = date.today()
+    model = StubModel(stub_reply, latency)
+    (_, problems, _), stats = timed(lambda: extract_record(model, images, today, parallel=False))
+    results["single"] = stats | {"calls": model.calls, "problems": len(problems)}
+    model = StubModel(stub_reply_needs_repair, latency)
+    (_, problems, info), stats = timed(lambda: extract_record(model, images, today, parallel=False))
+    results["single_repair"] = stats | {"calls": model.calls, "retries": info["retries"], "problems": len(problems)}
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ResultCache(tmp)
+        for phase in ("parallel_cold", "parallel_warm"):
+            model = StubModel(stub_reply, latency)
+            (_, problems, info), stats = timed(lambda: extract_record(model, images, today, cache, workers))
+            results[phase] = stats | {"calls": model.calls, "cache_hits": info["cache_hits"], "problems": len(problems)}
+    return results
+
+
+# 新しいプロセスで AppTest を1回だけ動かす (bench 自身は gspread などを import 済みなので、別プロセスでないと測れない)
+# ローカルの保存先は作っておく (コンテナの再起動・アイドルからの復帰と同じ。Sheets からの初回取り込みは含めない)
+COLD_START_CHILD = """
+import json, os, sys, tempfile
+sys.path.insert(0, {app_dir!r})
+from streamlit.testing.v1 import AppTest
+import sheets_io, startup
+from storage import DEFAULT_HEADERS, SQLiteStore
+
+def client(creds):
+    import fakes
+    return fakes.FakeClient({{k: [v] for k, v in DEFAULT_HEADERS.items()}})
+
+tmp = tempfile.mkdtemp()
+with open(os.path.join({app_dir!r}, {script!r}), encoding="utf-8") as fp: src = fp.read()
+with open(os.path.join(tmp, {script!r}), "w", encoding="utf-8") as fp: fp.write(src)
+store = SQLiteStore(os.path.join(tmp, "local_store.sqlite3"))
+for name, header in DEFAULT_HEADERS.items(): store.seed(name, header, [])
+sheets_io.use_client_factory(client)
+at = AppTest.from_file(os.path.join(tmp, {script!r}), default_timeout={timeout!r})
+at.secrets["gcp_json"] = "{{}}"
+at.secrets["spreadsheet_key"] = "bench"
+at.run()
+timer = startup.get_timer({script!r}[:-3])
+print(json.dumps({{
+    "phases": {{p["phase"]: p["ms"] for p in timer.report()}}, "total_ms": round(timer.total_ms(), 1),
+    "loaded": [m for m in {heavy!r} if m in sys.modules], "error": str(at.exception[0].value)[:200] if at.exception else None,
+}}))
+"""
+
+
+def run_cold_start(script, timeout):
+    """script (app.py / sleep_app.py) の プロセス開始 → 最初の描画 の区間と、それまでに import された重いモジュール"""
+    code = COLD_START_CHILD.format(app_dir=APP_DIR, script=script, timeout=timeout, heavy=HEAVY_MODULES)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, timeout=timeout + 30)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1][:200] if proc.stderr.strip() else f"exit {proc.returncode}"}
+    out = json.loads(proc.stdout.strip().splitlines()[-1])
+    return {f"{k}_ms": v for k, v in out["phases"].items()} | {"total_ms": out["total_ms"], "loaded": ",".join(out["loaded"]) or "-", "error": out["error"]}
+
+
+# --- 出力 ---
+def report(results, out):
+    for key, phases in results.items():
+        print(f"\n## {key}", file=out)
+        for phase, r in phases.items():
+            cols = [f"{k}={v}" for k, v in r.items() if k not in ("ops", "error")]
+            print(f"  {phase:<14} " + "  ".join(cols), file=out)
+            if r.get("ops"): print(f"  {'':<14} ops: " + ", ".join(f"{k}×{v}" for k, v in sorted(r["ops"].items())), file=out)
+            if r.get("error"): print(f"  {'':<14} ⚠️ {r['error']}", file=out)
+
+
+def check(results, baseline_path):
+    """API 呼び出し回数が基準より増えたシナリオを返す (遅延・時間は環境で変わるので比べない)"""
+    with open(baseline_path, encoding="utf-8") as fp:
+        baseline = json.load(fp)
+    worse = []
+    for key, phases in results.items():
+        for phase, r in phases.items():
+            base = baseline.get(key, {}).get(phase, {})
+            if "calls" in r and "calls" in base and r["calls"] > base["calls"]:
+                worse.append(f"{key} {phase}: {base['calls']} → {r['calls']} calls")
+    return worse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000, 10000, 100000])
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--latency", type=float, default=0.02, help="偽 Sheets の1回の呼び出しの遅延 (秒)")
+    parser.add_argument("--fail-every", type=int, default=0, help="n 回に1回 429 (クォータ超過) を返す")
+    parser.add_argument("--images", type=int, nargs="+", default=[1, 4, 12])
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="StubModel の1回の generate_content の遅延 (秒)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc を使わない (時間の計測が速くなる)")
+    parser.add_argument("--json", help="結果を JSON で保存する")
+    parser.add_argument("--baseline", help="この JSON より API 呼び出しが増えていたら終了コード 1")
+    parser.add_argument("--cold-start-only", action="store_true", help="起動時間だけを測る")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for script in ("app.py", "sleep_app.py"):
+        print(f"... cold start {script}", file=sys.stderr)
+        results[f"cold start {script}"] = {"first_paint": run_cold_start(script, args.timeout)}
+    if args.cold_start_only:
+        report(results, sys.stdout)
+        return 0
+
+    # 最初の AppTest は streamlit / pandas の import を含むので、計測前に1回だけ空で回す
+    run_app("sheets-direct", 10, 0.0, 0, args.timeout)
+    if not args.no_memory: tracemalloc.start()
+    for n in args.rows:
+        for mode in args.modes:
+            key = f"app {mode} rows={n}"
+            print(f"... {key}", file=sys.stderr)
+            results[key] = run_app(mode, n, args.latency, args.fail_every, args.timeout)
+    for n in args.images:
+        key = f"analyze images={n}"
+        print(f"... {key}", file=sys.stderr)
+        results[key] = run_analyze(n, args.gemini_latency, args.workers)
+
+    print(f"# bench latency={args.latency}s fail_every={args.fail_every} gemini_latency={args.gemini_latency}s workers={args.workers}")
+    report(results, sys.stdout)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fp:
+            json.dump(results, fp, ensure_ascii=False, indent=1)
+    if args.baseline:
+        worse = check(results, args.baseline)
+        for line in worse: print(f"REGRESSION {line}")
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+隠しデバッグ表示 (app.py / sleep_app.py 共通)
+URL に ?debug=1 を付けた時だけ、Sheets / Gemini 呼び出しの記録 (tracing.Tracer) と起動時間 (startup.StartupTimer) を表示する。
+"""
+import time
+
+import streamlit as st
+
+from tracing import set_session
+
+
+def trace_session():
+    """このセッションのトレース用 ID を決めて、スクリプトを実行しているスレッドに設定する (毎回の実行の最初に呼ぶ)"""
+    session = st.session_state.setdefault('_trace_session', f"{time.time_ns() % 10 ** 8:08d}")
+    set_session(session)
+    return session
+
+
+def debug_enabled():
+    return st.query_params.get("debug") in ("1", "true")
+
+
+def show_trace_panel(tracer, csv_path, startup=None):
+    with st.expander("🐞 Debug: API 呼び出しの記録"):
+        if startup is not None and startup.done:
+            st.caption(f"このプロセスの起動: 最初の描画までプロセス開始から {startup.total_ms():,.0f} ms (server = プロセス開始 → 1回目のスクリプト実行)")
+            st.dataframe(startup.report(), hide_index=True, use_container_width=True)
+        q = tracer.quota()
+        st.caption(f"直近60秒 (プロセス全体) の Sheets: 読み取り {q['read']} 回 / 書き込み {q['write']} 回 / 429 {q['rate_limited']} 回 (上限の目安: それぞれ 60 回/分)")
+        scope = st.radio("範囲", ["このセッション", "プロセス全体 (バックグラウンド同期を含む)"], horizontal=True, key="_trace_scope")
+        session = st.session_state.get('_trace_session') if scope == "このセッション" else None
+        events = tracer.events(session)
+        if not events:
+            st.info("まだ記録がありません"); return
+        st.dataframe(tracer.summary(session), hide_index=True, use_container_width=True)
+        t0 = events[0]["ts"]
+        timeline = [{"at_s": round(e["ts"] - t0, 3), **{k: e[k] for k in ("kind", "target", "op", "ms", "sent", "received", "error", "retry", "session")}} for e in events]
+        st.bar_chart(timeline, x="at_s", y="ms", color="kind")
+        st.dataframe(timeline[::-1], hide_index=True, use_container_width=True)
+        c1, c2 = st.columns(2)
+        c1.download_button("⬇️ CSV をダウンロード", tracer.to_csv(session=session), file_name="trace.csv", mime="text/csv", use_container_width=True)
+        if c2.button("💾 サーバーに CSV を書き出す", use_container_width=True):
+            st.caption(f"書き出しました: {tracer.to_csv(csv_path, session)}")
+        if tracer.path: st.caption(f"全呼び出しは {tracer.path} にも JSONL で追記しています")
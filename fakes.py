@@ -0,0 +1,236 @@
+"""
+オフライン用の偽バックエンド
+- FakeClient / FakeWorksheet: gspread の Client / Spreadsheet / Worksheet 互換の最小実装
+- StubModel                 : genai.GenerativeModel の代わり (generate_content だけ)
+ネットワークや認証情報なしで保存キュー・書き込みレイヤー・画像解析を動かすために使う。
+
+    client = FakeClient({"SleepLog": [["date", "sleep_score"]]})
+    pool = SheetPool({}, spreadsheet_key=FakeClient.KEY, client_factory=lambda creds: client)
+"""
+import json
+import re
+import threading
+import time
+
+import requests
+from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+_RANGE = re.compile(r"^(?:(?P<sheet>'[^']*'|[^!]+)!)?(?P<c1>[A-Z]+)(?P<r1>\d*)(?::(?P<c2>[A-Z]+)(?P<r2>\d*))?$")
+
+
+def _response(code, message, status):
+    response = requests.Response()
+    response.status_code = code
+    response._content = json.dumps({"error": {"code": code, "message": message, "status": status}}).encode()
+    return response
+
+
+def quota_error(code=429, message="Quota exceeded for quota metric 'Write requests'"):
+    """Sheets API と同じ形の APIError を作る"""
+    return APIError(_response(code, message, "RESOURCE_EXHAUSTED"))
+
+
+def _col(letters):
+    return a1_to_rowcol(f"{letters}1")[1]
+
+
+class FakeWorksheet:
+    """
+    メモリ上の2次元リストを持つ Worksheet。
+    latency: 1回の API 呼び出しにかける秒数
+    fail_every: n 回に1回 quota_error() を投げる (0 なら投げない)
+    """
+
+    def __init__(self, title, values=None, row_count=1000, col_count=26, latency=0.0, fail_every=0):
+        self.title = title
+        self.data = [list(r) for r in (values or [])]
+        self.row_count = max(row_count, len(self.data))
+        self.col_count = col_count
+        self.latency = latency
+        self.fail_every = fail_every
+        self.calls = 0
+        self.log = []
+        self._lock = threading.Lock()
+
+    # --- 内部 ---
+    def _call(self, name):
+        with self._lock:
+            self.calls += 1
+            self.log.append(name)
+            n = self.calls
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_every and n % self.fail_every == 0:
+            raise quota_error()
+
+    def _bounds(self, a1):
+        m = _RANGE.match(a1)
+        if not m:
+            raise ValueError(f"bad range: {a1}")
+        c1, r1 = _col(m["c1"]), int(m["r1"] or 1)
+        c2 = _col(m["c2"]) if m["c2"] else c1
+        if m["c2"] is None:
+            r2 = r1
+        else:
+            r2 = int(m["r2"]) if m["r2"] else self.row_count
+        return r1, c1, r2, c2
+
+    def _read(self, a1):
+        r1, c1, r2, c2 = self._bounds(a1)
+        rows = []
+        for r in range(r1, min(r2, len(self.data)) + 1):
+            row = self.data[r - 1][c1 - 1:c2]
+            while row and row[-1] in ("", None):
+                row.pop()
+            rows.append(row)
+        while rows and not rows[-1]:
+            rows.pop()
+        return rows
+
+    def _write(self, a1, values):
+        r1, c1, _, _ = self._bounds(a1)
+        for i, vals in enumerate(values):
+            r = r1 + i
+            if r > self.row_count:
+                raise APIError(_response(400, f"Range ({self.title}!{a1}) exceeds grid limits", "INVALID_ARGUMENT"))
+            while len(self.data) < r:
+                self.data.append([])
+            row = self.data[r - 1]
+            row.extend([""] * (c1 - 1 + len(vals) - len(row)))
+            row[c1 - 1:c1 - 1 + len(vals)] = [str(v) if v is not None else "" for v in vals]
+
+    def _used_rows(self):
+        n = len(self.data)
+        while n and not any(self.data[n - 1]):
+            n -= 1
+        return n
+
+    # --- gspread.Worksheet 互換 API ---
+    def get_all_values(self):
+        self._call("get_all_values")
+        width = max([len(r) for r in self.data] or [0])
+        return [list(r) + [""] * (width - len(r)) for r in self.data[:self._used_rows()]]
+
+    def col_values(self, col):
+        self._call("col_values")
+        vals = [r[col - 1] if len(r) >= col else "" for r in self.data]
+        while vals and vals[-1] in ("", None):
+            vals.pop()
+        return vals
+
+    def row_values(self, row):
+        self._call("row_values")
+        vals = [str(v) for v in self.data[row - 1]] if row <= len(self.data) else []
+        while vals and vals[-1] == "":
+            vals.pop()
+        return vals
+
+    def get(self, range_name):
+        self._call("get")
+        return self._read(range_name)
+
+    def batch_get(self, ranges):
+        self._call("batch_get")
+        return [self._read(r) for r in ranges]
+
+    def update(self, range_name=None, values=None, value_input_option=None, **kwargs):
+        self._call("update")
+        self._write(range_name, values)
+        return {"updatedRange": f"{self.title}!{range_name}"}
+
+    def update_cell(self, row, col, value):
+        self._call("update_cell")
+        self._write(rowcol_to_a1(row, col), [[value]])
+
+    def batch_update(self, data, value_input_option=None, **kwargs):
+        self._call("batch_update")
+        for d in data:
+            self._write(d["range"], d["values"])
+        return {"totalUpdatedRows": sum(len(d["values"]) for d in data)}
+
+    def append_row(self, values, value_input_option=None, **kwargs):
+        return self.append_rows([values], value_input_option, **kwargs)
+
+    def append_rows(self, values, value_input_option=None, **kwargs):
+        self._call("append_rows")
+        start = self._used_rows() + 1
+        self.row_count = max(self.row_count, start + len(values) - 1)
+        self._write(f"A{start}", values)
+        end = start + len(values) - 1
+        width = max(len(v) for v in values)
+        return {"updates": {"updatedRange": f"{self.title}!A{start}:{rowcol_to_a1(end, width)}"}}
+
+    def add_rows(self, rows):
+        self._call("add_rows")
+        self.row_count += rows
+
+    def add_cols(self, cols):
+        self._call("add_cols")
+        self.col_count += cols
+
+
+class FakeSpreadsheet:
+    def __init__(self, worksheets, key):
+        self.id = key
+        self._worksheets = worksheets
+
+    def worksheets(self):
+        return list(self._worksheets.values())
+
+    def worksheet(self, title):
+        if title not in self._worksheets:
+            raise WorksheetNotFound(title)
+        return self._worksheets[title]
+
+
+class FakeClient:
+    """{title: 2次元リスト or FakeWorksheet} からスプレッドシート1つ分の偽クライアントを作る"""
+
+    KEY = "fake-spreadsheet-key"
+
+    def __init__(self, sheets, **worksheet_kwargs):
+        self.worksheets = {
+            title: ws if isinstance(ws, FakeWorksheet) else FakeWorksheet(title, ws, **worksheet_kwargs)
+            for title, ws in sheets.items()
+        }
+        self.opens = 0
+
+    def open(self, title):
+        self.opens += 1
+        return FakeSpreadsheet(self.worksheets, self.KEY)
+
+    def open_by_key(self, key):
+        self.opens += 1
+        return FakeSpreadsheet(self.worksheets, key)
+
+
+class StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    """
+    genai.GenerativeModel の代わり。
+    reply: dict (毎回同じ JSON を返す) か、parts を受け取って dict / 文字列を返す関数
+    latency: 1回の generate_content にかける秒数
+    configs: 呼び出しごとに渡された generation_config (聞き直しのスキーマを確かめる用)
+    """
+
+    def __init__(self, reply=None, latency=0.0, model_name="models/stub"):
+        self.reply = reply if reply is not None else {}
+        self.latency = latency
+        self.model_name = model_name
+        self.calls = 0
+        self.configs = []
+        self._lock = threading.Lock()
+
+    def generate_content(self, parts, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self.configs.append(kwargs.get("generation_config"))
+        if self.latency:
+            time.sleep(self.latency)
+        out = self.reply(parts) if callable(self.reply) else self.reply
+        return StubResponse(out if isinstance(out, str) else json.dumps(out, ensure_ascii=False))
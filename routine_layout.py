@@ -0,0 +1,50 @@
+"""
+ダッシュボード (app.py) の静的な部品
+Streamlit は操作のたびに app.py を上から実行し直すので、毎回同じになる CSS・項目リスト・サプリ文字列は
+このモジュールでプロセスに1回だけ作る (import は1回しか実行されない)。
+"""
+from datetime import time
+
+CSS = """
+    <style>
+    .block-container { padding-top: 2rem; padding-bottom: 5rem; }
+    div.stButton > button {
+        width: 100%; background-color: #007AFF; color: white;
+        font-weight: bold; border-radius: 10px; padding: 0.5rem 1rem; border: none;
+    }
+    div.stButton > button:hover { background-color: #0056b3; color: white; }
+    </style>
+"""
+
+# 食事記録の同期時に自動で付けるサプリメント
+AUTO_SUPPLEMENTS = "\n• ".join([
+    "MCTオイル 7g", "カルニチン 4錠", "タケダVitC 9錠", "QPコーワα 1錠", "ビタミンD 1錠", "エビオス 30錠", "ビオスリー 6錠",
+    "thoren Stress B complex 2錠", "ビオチン 2錠", "QPコーワヒーリング2錠", "マグネシウム2錠", "テアニン1錠",
+])
+
+# key → (タイトル, 項目, 既定の実施時刻)。タイトルの {workout} は運動種目に置き換える。既定時刻が None のものは予定から計算
+ROUTINES = {
+    "morning_ignition": ("1. 爆速点火フェーズ", ["MCTオイル 7g", "マグネシウム 2錠", "クルクミン 2錠", "カルニチン 2錠", "NAC 1錠", "R-リポ 1錠", "タケダVitC 3錠", "QPコーワα 1錠", "ビタミンD 1錠"], time(7, 15)),
+    "morning_muscle": ("2. 筋肉起動 & 温冷浴", ["ヨガ・プランク2分・スクワット10", "温水3分 ➡ 冷水1分"], time(7, 45)),
+    "morning_walk": ("3. 朝散歩", ["外気浴 15-20分"], time(8, 0)),
+    "morning_breakfast": ("4. 朝食 & サプリ", ["ベースブレッド 1個", "エビオス 10錠", "ビオスリー 2錠", "Stress B 1錠", "Omega3 2錠", "ビオチン 2錠"], time(8, 30)),
+    "lunch": ("5. 昼食 (代謝維持)", ["ベースブレッド", "エビオス 10錠", "ビオスリー 2錠", "タケダVitC 3錠"], time(12, 0)),
+    "evening_pre_workout": ("6. 運動前準備 ({workout})", ["カルニチン 2錠 (30分前)"], None),
+    "evening_workout": ("7. ガチ運動 ({workout})", ["心拍数管理", "水分補給"], None),
+    "dinner_after": ("8. 夕食後", ["ご飯 MAX 120g", "エビオス 10錠", "ビオスリー 2錠", "V-E400 1錠", "Omega3 2錠", "Stress B 1錠"], time(19, 0)),
+    "bedtime_routine": ("9. 究極回復セット", ["お風呂 15分 (40℃)", "QPコーワヒーリング 2錠", "亜鉛 1錠", "マグネシウム 2錠", "( 運動した日はクルクミン 2錠 )", "テアニン 1錠", "タケダVitC 3錠"], None),
+}
+CARNITINE_SLIDE = "💊 カルニチン 2錠 (夕方分スライド)"  # 運動しない日は就寝前に回す
+
+
+def items_text(items):
+    """項目リスト → 1つの st.text で出す箇条書き"""
+    return "\n".join(f"• {item}" for item in items)
+
+
+ITEMS_TEXT = {key: items_text(items) for key, (_, items, _) in ROUTINES.items()}
+BEDTIME_SLIDE_TEXT = items_text(ROUTINES["bedtime_routine"][1] + [CARNITINE_SLIDE])
+
+DONE_HTML = '<div style="background-color: #f0f2f6; padding: 10px; border-radius: 10px; color: gray;"><h4 style="margin:0; text-decoration: line-through;">{title}</h4><small>✅ Completed at {at}</small></div>'
+SKIPPED_HTML = '<div style="background-color: #e0e0e0; padding: 10px; border-radius: 10px; color: #9e9e9e;"><h4 style="margin:0;">{title}</h4><small>⚠️ Skipped (Rest Day)</small></div>'
+TARGET_HTML = "### {title} <span style='color:#FF4B4B; font-size:0.85em;'>({target})</span>"
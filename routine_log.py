@@ -0,0 +1,116 @@
+"""
+v2 (ルーティーン) の列指向ストレージ
+Progress 列の JSON に加えて、9つのルーティーンを J〜R 列に1つずつ (完了時刻 "HH:MM" / "SKIPPED" / 空欄) 持たせる。
+- progress_columns : 保存する行の J〜R 列の値
+- migrate          : 既存の行の Progress JSON を J〜R 列に展開する (明示的に1回だけ・1回の update。J〜R 列が空の時だけ)
+- load_routine_log : 行 → 型付き DataFrame (完了時刻は0時からの分)。集計は列演算だけで済む
+pandas / gspread は使う関数の中で import する (app.py は起動時に ROUTINE_KEYS などの定数しか使わない)。
+"""
+import json
+
+ROUTINE_KEYS = ["morning_ignition", "morning_muscle", "morning_walk", "morning_breakfast", "lunch", "evening_pre_workout", "evening_workout", "dinner_after", "bedtime_routine"]
+WORKOUT_KEYS = ["evening_pre_workout", "evening_workout"]  # Workout が「なし」の日は表示されない
+BASE_COLUMNS = 9  # A〜I: Date, WakeTime, Workout, -, -, WorkoutTime, BedTime, Progress, Diary
+SKIPPED = "SKIPPED"
+
+
+def progress_columns(progress):
+    """{key: "HH:MM" / "SKIPPED"} → ROUTINE_KEYS 順の列の値 (未実施は空欄)"""
+    return [progress.get(k, "") for k in ROUTINE_KEYS]
+
+
+def _load_progress(text):
+    try: return json.loads(text) if text else {}
+    except ValueError: return {}
+
+
+def has_columns(header):
+    return list(header[BASE_COLUMNS:BASE_COLUMNS + len(ROUTINE_KEYS)]) == ROUTINE_KEYS
+
+
+def migrate(sheet):
+    """
+    既存の全行の Progress JSON を J〜R 列に展開し、ヘッダーと一緒に1回の update で書き込む。
+    既に展開済み (J1〜R1 がルーティーン名) なら何もしない。
+    J〜R 列に1つでも値があれば、上書きせずに ValueError (列が足りなければ add_cols で足す)。戻り値: 展開した行数
+    """
+    from gspread.utils import rowcol_to_a1
+    values = sheet.get_all_values()
+    if not values or has_columns(values[0]):
+        return 0
+    width = BASE_COLUMNS + len(ROUTINE_KEYS)
+    used = [i + 1 for i, r in enumerate(values) if any(str(v).strip() for v in r[BASE_COLUMNS:width])]
+    if used:
+        raise ValueError(f"J〜R 列に既にデータがあります ({len(used)} 行、最初は {used[0]} 行目)。上書きしないので、列を空けてからやり直してください")
+    if sheet.col_count < width:
+        sheet.add_cols(width - sheet.col_count)
+    progress_col = values[0].index("Progress") if "Progress" in values[0] else BASE_COLUMNS - 2
+    cells = [ROUTINE_KEYS] + [
+        progress_columns(_load_progress(r[progress_col] if len(r) > progress_col else "")) for r in values[1:]
+    ]
+    first = rowcol_to_a1(1, BASE_COLUMNS + 1)
+    last = rowcol_to_a1(len(values), BASE_COLUMNS + len(ROUTINE_KEYS))
+    sheet.update(range_name=f"{first}:{last}", values=cells)
+    return len(values) - 1
+
+
+def _clock_minutes(s):
+    """'HH:MM' / 'HH:MM:SS' → 0時からの分 (Int64、読めなければ NA)"""
+    import pandas as pd
+    hm = s.astype("string").str.extract(r"^(\d{1,2}):(\d{2})").apply(pd.to_numeric)
+    return (hm[0] * 60 + hm[1]).astype("Int64")
+
+
+def load_routine_log(header, rows):
+    """
+    v2 の行 → 1日1行の型付き DataFrame (index: date)
+    - {key}     : 完了時刻 (0時からの分, Int64。未実施・スキップは NA)
+    - {key}_skipped : スキップしたか (bool)
+    - wake / workout_start / bed_target : 予定時刻 (分)、no_workout: 運動なしの日か
+    J〜R 列が無い古いシートでは、Progress JSON から同じ列を作る (行ごとのパースになる)。
+    """
+    import pandas as pd
+    headers = [h if (h and h.strip()) else f"COL_{i}" for i, h in enumerate(header)]
+    df = pd.DataFrame(rows, columns=headers)
+    if has_columns(header):
+        flat = df[ROUTINE_KEYS]
+    else:
+        progress = df.get("Progress", pd.Series("", index=df.index)).map(_load_progress)
+        flat = pd.DataFrame(progress.map(progress_columns).tolist(), columns=ROUTINE_KEYS, index=df.index)
+    col = lambda name: df.get(name, pd.Series("", index=df.index))
+    out = pd.DataFrame({
+        "date": pd.to_datetime(col("Date"), errors="coerce", format="mixed"),
+        "wake": _clock_minutes(col("WakeTime")),
+        "workout_start": _clock_minutes(col("WorkoutTime")),
+        "bed_target": _clock_minutes(col("BedTime")),
+        "no_workout": col("Workout").astype(str).str.contains("なし"),
+    })
+    for k in ROUTINE_KEYS:
+        out[k] = _clock_minutes(flat[k])
+        out[f"{k}_skipped"] = flat[k].astype(str).str.strip() == SKIPPED
+    return out.dropna(subset=["date"]).drop_duplicates("date", keep="last").set_index("date")
+
+
+def completion_stats(log):
+    """ルーティーンごとの完了率・スキップ率・完了時刻の中央値 (分)・起床からの中央値 (分) を列演算で出す"""
+    import pandas as pd
+    done = log[ROUTINE_KEYS].notna()
+    skipped = log[[f"{k}_skipped" for k in ROUTINE_KEYS]].set_axis(ROUTINE_KEYS, axis=1)
+    shown = pd.DataFrame(True, index=log.index, columns=ROUTINE_KEYS)
+    for k in WORKOUT_KEYS: shown[k] = ~log["no_workout"]
+    expected = shown & ~skipped
+    since_wake = log[ROUTINE_KEYS].sub(log["wake"], axis=0).astype("float64")
+    return pd.DataFrame({
+        "completion_rate": done.sum() / expected.sum().where(expected.sum() > 0),
+        "skip_rate": skipped.sum() / shown.sum().where(shown.sum() > 0),
+        "median_time": log[ROUTINE_KEYS].astype("float64").median(),
+        "median_since_wake": since_wake.median(),
+    })
+
+
+def completion_rate(log):
+    """日ごとの完了率 (完了数 / (表示されたルーティーン - スキップ))"""
+    done = log[ROUTINE_KEYS].notna().sum(axis=1)
+    skipped = log[[f"{k}_skipped" for k in ROUTINE_KEYS]].sum(axis=1)
+    expected = len(ROUTINE_KEYS) - log["no_workout"] * len(WORKOUT_KEYS) - skipped
+    return (done / expected.where(expected > 0)).clip(upper=1).astype("Float64")
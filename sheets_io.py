@@ -0,0 +1,441 @@
+"""
+Google Sheets 接続 & 書き込みレイヤー (app.py / sleep_app.py 共通)
+- SheetPool    : gspread クライアントとワークシートハンドルをプロセス内で使い回す
+- CountingSheet: Worksheet をラップして API 呼び出し回数を数える
+- RowWriter    : 1行の保存を1回の範囲更新で送る (diff モードでは変わった列だけ)
+- RowIndex     : date → 行番号 のローカル索引 (保存のたびに A列を読み直さない)
+- read_tail    : ヘッダーと末尾の数十行だけを読む (起動時の復元用)
+- upsert_by_date: 複数行を日付で upsert (1回の batch_update)
+gspread (requests・google-auth を含めて import が重い) は Sheets に最初に触る時まで import しない。
+"""
+import functools
+import json
+import re
+import threading
+
+WRITE_MODES = ("batch", "diff")
+
+
+@functools.lru_cache(maxsize=None)
+def parse_service_account(raw_json):
+    """Secrets の gcp_json (バックスラッシュが二重エスケープされていない JSON) をパースする (同じ文字列はプロセス内で1回だけ)"""
+    # 【Invalid \escape 対策】
+    safe_json = raw_json.strip().replace('\\', '\\\\').replace('\\\\n', '\\n')
+    creds_dict = json.loads(safe_json, strict=False)
+    # 秘密鍵の改行を復元
+    if "private_key" in creds_dict:
+        creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n").strip()
+    return creds_dict
+
+
+def service_account_client(creds_dict):
+    """サービスアカウントの gspread クライアント (SheetPool の既定の client_factory)"""
+    import gspread
+    return gspread.service_account_from_dict(creds_dict)
+
+
+def _is_session_error(e):
+    """トークン切れ・認証切れ (作り直せば通るエラー) か"""
+    import gspread
+    from google.auth.exceptions import RefreshError
+    if isinstance(e, RefreshError): return True
+    return isinstance(e, gspread.exceptions.APIError) and e.code == 401
+
+
+class SheetPool:
+    """
+    gspread クライアントとワークシートハンドルをプロセス内で使い回す。
+    スプレッドシートは名前ではなくキーで開く (キーがなければ最初の1回だけ名前で検索してキーを覚える)。
+    クライアントは最初にワークシートを開く時に作る (作るだけなら gspread の import も認証もしない)。
+    アクセストークンの期限切れは gspread (google-auth) のセッションが自動で更新する。
+    それでも認証エラーになった時は、クライアントを作り直して1回だけやり直す。
+    tracer (tracing.Tracer) を渡すと、認証・スプレッドシートを開く呼び出しとワークシートの全メソッドを記録する。
+    """
+
+    def __init__(self, creds_dict, spreadsheet_key=None, spreadsheet_name=None,
+                 client_factory=service_account_client, tracer=None):
+        if not (spreadsheet_key or spreadsheet_name):
+            raise ValueError("spreadsheet_key か spreadsheet_name が必要です")
+        self._creds = creds_dict
+        self._client_factory = client_factory  # テスト・ベンチでは fakes.FakeClient を渡す
+        self.key = spreadsheet_key
+        self.name = spreadsheet_name
+        self.tracer = tracer
+        self._lock = threading.RLock()
+        self._client = None
+        self._worksheets = {}
+        self._indexes = {}
+
+    def _traced(self, target, op, fn, args=(), kwargs=None, retry=0):
+        if self.tracer is None:
+            return fn(*args, **(kwargs or {}))
+        return self.tracer.call("sheets", target, op, fn, args, kwargs, retry)
+
+    def _connect(self):
+        self._client = self._traced("-", "connect", self._client_factory, (self._creds,))
+
+    def _open(self):
+        if self._client is None:
+            self._connect()
+        if self.key:
+            sh = self._traced(self.key, "open_by_key", self._client.open_by_key, (self.key,))
+        else:
+            sh = self._traced(self.name, "open", self._client.open, (self.name,))  # Drive 検索はプロセス内で1回だけ
+            self.key = sh.id
+        self._worksheets = {ws.title: ws for ws in self._traced(self.key, "worksheets", sh.worksheets)}
+
+    def call(self, title, name, args=(), kwargs=None, retry=0):
+        """ワークシート title のメソッド name を呼ぶ (tracer があれば記録)"""
+        return self._traced(title, name, getattr(self.worksheet(title), name), args, kwargs, retry)
+
+    def worksheet(self, title):
+        """生の gspread.Worksheet (キャッシュ済み) を返す"""
+        with self._lock:
+            if title not in self._worksheets:
+                self._open()
+            if title not in self._worksheets:
+                from gspread.exceptions import WorksheetNotFound
+                raise WorksheetNotFound(title)
+            return self._worksheets[title]
+
+    def sheet(self, title, retry=0):
+        """認証切れから自動で復帰する Worksheet プロキシを返す (retry: 呼び出し側の再送回数。記録用)"""
+        self.worksheet(title)  # 開けないシートはここでエラーにする
+        return PooledSheet(self, title, retry)
+
+    def index(self, title):
+        """ワークシートごとの date → 行番号 索引 (プロセス内の全セッション・キュー書き込みで共有)"""
+        with self._lock:
+            if title not in self._indexes:
+                self._indexes[title] = RowIndex()
+            return self._indexes[title]
+
+    def reset(self):
+        """クライアントとハンドルを捨てる (次の呼び出しで作り直す)"""
+        with self._lock:
+            self._client, self._worksheets = None, {}
+
+
+class PooledSheet:
+    """SheetPool のワークシートへのプロキシ。認証エラーの時だけクライアントを作り直して1回やり直す"""
+
+    def __init__(self, pool, title, retry=0):
+        self._pool = pool
+        self.title = title
+        self.retry = retry
+
+    def __getattr__(self, name):
+        attr = getattr(self._pool.worksheet(self.title), name)
+        if not callable(attr):
+            return attr
+
+        def pooled(*args, **kwargs):
+            try:
+                return self._pool.call(self.title, name, args, kwargs, retry=self.retry)
+            except Exception as e:
+                # 401 はリクエストが処理されていないので、書き込みでもやり直して安全
+                if not _is_session_error(e): raise
+                self._pool.reset()
+                return self._pool.call(self.title, name, args, kwargs, retry=self.retry + 1)
+        return pooled
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+_client_factory = service_account_client
+
+
+def use_client_factory(factory):
+    """
+    get_pool が作る SheetPool のクライアントを差し替え、作り済みの SheetPool を捨てる。
+    ベンチ (bench.py) やオフラインの確認で fakes.FakeClient を使う時に呼ぶ。
+    """
+    global _client_factory
+    with _pools_lock:
+        _client_factory = factory
+        _pools.clear()
+
+
+def get_pool(raw_json, spreadsheet_key=None, spreadsheet_name=None, tracer=None):
+    """同じスプレッドシートの SheetPool をプロセス内で1つだけ作る (両アプリで共有)"""
+    with _pools_lock:
+        pool_key = spreadsheet_key or spreadsheet_name
+        if pool_key not in _pools:
+            _pools[pool_key] = SheetPool(parse_service_account(raw_json), spreadsheet_key, spreadsheet_name, _client_factory, tracer)
+        elif tracer is not None and _pools[pool_key].tracer is None:
+            _pools[pool_key].tracer = tracer
+        return _pools[pool_key]
+
+
+class CountingSheet:
+    """Worksheet のメソッド呼び出し (= API ラウンドトリップ) を calls に数えるプロキシ"""
+
+    def __init__(self, sheet):
+        self._sheet = sheet
+        self.calls = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._sheet, name)
+        if not callable(attr):
+            return attr
+
+        def counted(*args, **kwargs):
+            self.calls += 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+def _changed_runs(old, new):
+    """old と new で値が違う列を連続区間 [(start, end), ...] (0始まり・両端含む) にまとめる"""
+    runs = []
+    for i, val in enumerate(new):
+        prev = old[i] if i < len(old) else None
+        if str(prev) == str(val):
+            continue
+        if runs and runs[-1][1] == i - 1:
+            runs[-1] = (runs[-1][0], i)
+        else:
+            runs.append((i, i))
+    return runs
+
+
+class RowWriter:
+    """
+    1シート分の行書き込み。
+    - batch: A{idx}:?{idx} の範囲を1回の update で上書き
+    - diff : 前回同期した行を覚えておき、変わった列だけを1回の batch_update で送る
+             (前回の記録がない行は batch と同じ全列書き込み)
+    """
+
+    def __init__(self, mode="batch", value_input_option="RAW"):
+        if mode not in WRITE_MODES:
+            raise ValueError(f"unknown write mode: {mode}")
+        self.mode = mode
+        self.value_input_option = value_input_option
+        self.last_rows = {}
+
+    def write_row(self, sheet, idx, row):
+        """idx 行目 (1始まり) に row を書き込む。送った API 呼び出し回数を返す"""
+        from gspread.utils import rowcol_to_a1
+        row = list(row)
+        last = self.last_rows.get(idx)
+        if self.mode == "diff" and last is not None:
+            runs = _changed_runs(last, row)
+            if runs:
+                data = [
+                    {"range": f"{rowcol_to_a1(idx, s + 1)}:{rowcol_to_a1(idx, e + 1)}", "values": [row[s:e + 1]]}
+                    for s, e in runs
+                ]
+                sheet.batch_update(data, value_input_option=self.value_input_option)
+            self.last_rows[idx] = row
+            return 1 if runs else 0
+
+        sheet.update(
+            range_name=f"A{idx}:{rowcol_to_a1(idx, len(row))}",
+            values=[row],
+            value_input_option=self.value_input_option,
+        )
+        self.last_rows[idx] = row
+        return 1
+
+    def forget(self, idx=None):
+        """記憶している行を捨てる (書き込み失敗時など、シート側の状態が分からなくなった時用)"""
+        if idx is None: self.last_rows.clear()
+        else: self.last_rows.pop(idx, None)
+
+
+_UPDATED_ROW = re.compile(r"![A-Z]+(\d+)")
+
+
+class RowIndex:
+    """
+    1シート分の date → 行番号 (1始まり) 索引。
+    起動時に読んだ A列から1回だけ作り、追記のたびに更新する。
+    書き込み失敗や想定外の行番号を見つけたら invalidate() して、次の保存で col_values(1) から作り直す。
+    手入力や他の端末からの追記で行がずれることがあるので、書き込む前に check() で A列を確かめる。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rows = None
+        self.next_row = None
+
+    @property
+    def built(self):
+        return self._rows is not None
+
+    def build(self, dates, start_row=1):
+        """
+        A列の値から索引を作る。dates[0] が start_row 行目。
+        (start_row=1 ならヘッダー込みの col_values(1) と同じ並び。read_tail の結果なら末尾だけの部分索引)
+        """
+        dates = [str(d) if d is not None else "" for d in dates]
+        while dates and not dates[-1].strip():
+            dates.pop()
+        rows = {}
+        for i, d in enumerate(dates):
+            if d: rows.setdefault(d, start_row + i)  # list.index と同じく最初の行を採用
+        with self._lock:
+            self._rows, self.next_row = rows, start_row + len(dates)
+
+    def ensure(self, sheet):
+        """索引がなければ A列を1回だけ読んで作る"""
+        if not self.built:
+            self.build(sheet.col_values(1))
+
+    def find(self, date):
+        with self._lock:
+            return self._rows.get(date) if self._rows is not None else None
+
+    def add(self, date, idx):
+        with self._lock:
+            if self._rows is None: return
+            self._rows.setdefault(date, idx)
+            self.next_row = max(self.next_row, idx + 1)
+
+    def record_append(self, date, response):
+        """append_row のレスポンス (updatedRange) で実際に書かれた行を確認して索引に加える"""
+        updated = ((response or {}).get("updates") or {}).get("updatedRange", "")
+        m = _UPDATED_ROW.search(updated)
+        if not m or int(m.group(1)) != self.next_row:
+            # 他の端末からの追記などで行数がずれている → 次回作り直す
+            self.invalidate()
+            return
+        self.add(date, int(m.group(1)))
+
+    def allocate(self, dates):
+        """まだ索引にない dates に next_row から連番の行番号を割り当てて {date: 行番号} を返す"""
+        with self._lock:
+            if self._rows is None: return {}
+            rows = {}
+            for d in dates:
+                if d in self._rows or d in rows: continue
+                rows[d] = self.next_row + len(rows)
+            return rows
+
+    def check(self, sheet, expected):
+        """
+        {行番号: A列にあるはずの値 (新しく書く行は "")} を1回の batch_get で確かめる。
+        1つでも違っていたら invalidate() して False (グリッドの外の行はまだないので読まない)
+        """
+        rows = sorted(r for r in expected if r <= sheet.row_count)
+        if not rows:
+            return True
+        for r, v in zip(rows, sheet.batch_get([f"A{r}" for r in rows])):
+            if (str(v[0][0]).strip() if v and v[0] else "") != expected[r]:
+                self.invalidate()
+                return False
+        return True
+
+    def invalidate(self):
+        with self._lock:
+            self._rows, self.next_row = None, None
+
+
+READ_TAIL_MAX_PROBES = 200
+
+
+def _pad(rows, width):
+    return [list(r) + [""] * (width - len(r)) for r in rows]
+
+
+def _trim(rows):
+    """末尾の A列が空の行を落とす (col_values(1) と同じ長さに揃える)"""
+    rows = [list(r) for r in rows]
+    while rows and not (rows[-1] and str(rows[-1][0]).strip()):
+        rows.pop()
+    return rows
+
+
+def read_tail(sheet, n, date=None, since=None):
+    """
+    ヘッダー行と、データ末尾 n 行程度だけを読む。
+    戻り値: (header, rows, start_row)  rows[0] が start_row 行目 (get_all_values と同じく幅を揃えて返す)
+    - 1回目の batch_get でヘッダー・グリッド末尾 n 行・n 行おきの A列プローブをまとめて読む
+      グリッド末尾が空き行だった時は、プローブで見つけたデータ末尾の周辺だけをもう1回読む
+    - date を渡した場合、末尾にその日付がなく、かつ末尾により新しい日付がある (= 並びが崩れている) 時だけ範囲を広げる
+      シートは日付順に追記されるので、末尾の最新日付が date より前なら date の行はまだ存在しない
+    - since を渡した場合、since 以降の日付がすべて入るまで (窓の最古の日付が since 以下になるまで) 範囲を広げる
+    """
+    from gspread.utils import rowcol_to_a1
+    last_col = rowcol_to_a1(1, sheet.col_count).rstrip("1")
+    start = max(2, sheet.row_count - n + 1)
+    probes = list(range(start - 1, 1, -n))[:READ_TAIL_MAX_PROBES - 1]
+    if probes and probes[-1] > 2 and len(probes) < READ_TAIL_MAX_PROBES - 1:
+        probes.append(2)  # 最後は必ず先頭のデータ行まで見る
+    # 終端行を書かない範囲 (A941:I) にして、row_count が古くても実際のグリッド末尾まで読む
+    header, body, *probed = sheet.batch_get(
+        [f"A1:{last_col}1", f"A{start}:{last_col}"] + [f"A{r}" for r in probes]
+    )
+    header = list(header[0]) if header else []
+    rows = _trim(body)
+
+    if not rows and probes:
+        hit = next((r for r, v in zip(probes, probed) if v and v[0] and str(v[0][0]).strip()), None)
+        if hit is not None or probes[-1] > 2:
+            # hit 行から下 n 行以内にデータ末尾がある (プローブが打ち切られた時は全体を読む)
+            start = max(2, hit - n + 1) if hit is not None else 2
+            rows = _trim(sheet.batch_get([f"A{start}:{last_col}"])[0])
+        else:
+            start = 2  # データ行なし
+
+    size = n
+    while (date is not None or since is not None) and rows and start > 2:
+        dates = [str(r[0]) for r in rows if r and str(r[0]).strip()]
+        if not dates:
+            break
+        if since is not None and min(dates) <= since:
+            break
+        if date is not None and (date in dates or max(dates) < date):
+            break
+        size *= 4
+        start = max(2, start - size)
+        rows = _trim(sheet.batch_get([f"A{start}:{last_col}"])[0])
+
+    width = max([len(header)] + [len(r) for r in rows])
+    return _pad([header], width)[0], _pad(rows, width), start
+
+
+def upsert_by_date(sheet, index, rows, value_input_option="RAW", update_existing=True):
+    """
+    rows (A列が日付の行) を日付で upsert する。全部まとめて1回の batch_update で送る。
+    - 既に索引にある日付は同じ行を上書き (update_existing=False なら飛ばす)
+    - 新しい日付は next_row から連番の行に書く (append と違い、右側に何があってもA列から書ける)
+    - 書く前に、上書きする行の A列がその日付で、新しい行が空であることを1回の batch_get で確かめる
+      (手入力・他の端末からの追記で索引がずれていたら、A列を読み直して1回だけやり直す)
+    同じ日付が複数あれば後の行を採用する。戻り値: (書き込んだ日付, 飛ばした日付)
+    """
+    from gspread.utils import rowcol_to_a1
+    by_date = {str(r[0]): list(r) for r in rows}
+    for _ in range(2):
+        index.ensure(sheet)
+        new_rows = index.allocate(list(by_date))
+        data, written, skipped, expected = [], [], [], {}
+        for date, row in by_date.items():
+            idx = new_rows.get(date)
+            if idx is None:
+                if not update_existing:
+                    skipped.append(date)
+                    continue
+                idx = index.find(date)
+            expected[idx] = "" if date in new_rows else date
+            data.append({"range": f"A{idx}:{rowcol_to_a1(idx, len(row))}", "values": [row]})
+            written.append(date)
+        if not data:
+            return written, skipped
+        if index.check(sheet, expected):
+            break
+    else:
+        raise RuntimeError(f"{getattr(sheet, 'title', '')} の A列が書き込み中に変わりました (次の同期でやり直します)")
+    try:
+        if new_rows:
+            last = max(new_rows.values())
+            if last > sheet.row_count:
+                sheet.add_rows(last - sheet.row_count)
+        sheet.batch_update(data, value_input_option=value_input_option)
+    except Exception:
+        index.invalidate()
+        raise
+    for date, idx in new_rows.items():
+        index.add(date, idx)
+    return written, skipped
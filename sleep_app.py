@@ -1,79 +1,170 @@
+from startup import get_timer
+startup = get_timer('sleep_app')  # プロセス開始 → 最初の描画 の区間を記録 (?debug=1 と標準エラーに表示)
+startup.mark('server')
 import streamlit as st
-import google.generativeai as genai
-import gspread
-import json
-from PIL import Image
+import os
+from datetime import datetime, timedelta, timezone
+from sheets_io import get_pool
+from sleep_vision import ResultCache, extract_each, fingerprint, group_by_date, iter_folder_images, iter_zip_images, preprocess_image
+from sleep_extract import MAX_RETRIES, extract_record, generation_config, sleep_prompt
+from sleep_schema import SLEEP_SCHEMA, frame_from_records, frame_from_values, normalize_sleep_frame, to_sheet_values, validate_record
+from debug_panel import debug_enabled, show_trace_panel, trace_session
+from storage import MemoryStore, MirroredStore, SheetsStore, SQLiteStore
+from tracing import TracedModel, get_tracer
+from write_queue import WriteQueue
+startup.mark('import')  # google.generativeai / pandas / gspread はここでは読まない (解析・保存・正規化で初めて import)
 
 # 🚀 ページ設定
 st.set_page_config(page_title="Sleep Analyzer 2026", page_icon="🌙")
+trace_session()  # このセッションの Sheets / Gemini 呼び出しに ID を付ける (?debug=1 で表示)
 
 # ⚙️ 接続設定
-if "GOOGLE_API_KEY" in st.secrets:
-    genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STORAGE = 'sqlite'  # 'sqlite': ローカルの SQLite に保存して Sheets へは非同期ミラー / 'memory': メモリ上 / 'sheets': 保存キュー経由で Sheets だけに書く
+STORE_PATH = os.path.join(APP_DIR, 'local_store.sqlite3')  # app.py と共通
+QUEUE_PATH = os.path.join(APP_DIR, 'pending_sleep_writes.sqlite3')
+MODEL_NAME = 'models/gemini-3-flash-preview'
+ANALYZE_MODE = 'parallel'  # 'parallel': 1枚ずつ並列 + 画像ごとのキャッシュ / 'single': 全枚数を1回で解析
+ANALYZE_CONCURRENCY = 4  # 同時に投げる generate_content の数
+ANALYSIS_CACHE_DIR = os.path.join(APP_DIR, '.cache', 'sleep_analysis')
+ANALYSIS_CACHE_MAX = 500  # キャッシュしておく画像の数 (超えたら古い順に削除)
+PREPROCESS = True  # 解析前に余白カット・縮小・再エンコードする
+PREPROCESS_MAX_DIM = 1280  # 縮小後の長辺 (px)
+PREPROCESS_FORMAT = 'JPEG'  # 'JPEG' / 'WEBP'
+PREPROCESS_QUALITY = 80
+SHOW_IMAGE_BYTES = False  # 縮小前後の合計バイト数を表示する
+TRACE_PATH = os.path.join(APP_DIR, '.cache', 'trace.jsonl')  # Sheets / Gemini 呼び出しの記録 (JSONL, app.py と共通)
+TRACE_CSV_PATH = os.path.join(APP_DIR, '.cache', 'trace.csv')
+EXTRACT_RETRIES = MAX_RETRIES  # 検証で問題があった項目だけを聞き直す回数の上限 (0 で聞き直さない)
+JST = timezone(timedelta(hours=+9), 'JST')
 
-def get_worksheet():
-    # 1. SecretsからJSONを取得
-    raw_json = st.secrets["gcp_json"].strip()
-    
-    # 2. 【Invalid \escape 対策】
-    safe_json = raw_json.replace('\\', '\\\\').replace('\\\\n', '\\n')
-    creds_dict = json.loads(safe_json, strict=False)
-    
-    # 3. 秘密鍵の改行を復元
-    if "private_key" in creds_dict:
-        creds_dict["private_key"] = creds_dict["private_key"].replace("\\n", "\n").strip()
-    
-    gc = gspread.service_account_from_dict(creds_dict)
-    return gc.open('Phase4_Log').worksheet('SleepLog')
-
-def normalize_time_field(value):
-    """
-    Geminiから返ってきた値を必ず H:MM 形式の文字列にする。
-    ありうる入力パターン:
-      - "0:47" / "00:47"  → そのまま H:MM で返す
-      - 57                → 分として H:MM に変換
-      - 57.0              → 同上
-      - "57"              → 同上
-      - "1:18:00"         → H:MM に変換
-    """
-    if value is None or value == "":
-        return "0:00"
-
-    s = str(value).strip()
-
-    # "H:MM" か "HH:MM" の形式なら直接パース
-    if ":" in s:
-        parts = s.split(":")
-        h = int(parts[0])
-        m = int(parts[1])
-        return f"{h}:{m:02d}"
-
-    # 数値（分）の場合
+def get_sheet_pool():
+    # クライアント・ワークシートは sheets_io でプロセス内共有 (保存ごとの認証 + Drive 検索をしない)
+    # Secrets に gcp_json がなければ None (ローカルの保存先だけで動き、Sheets へのミラーは溜めておく)
     try:
-        total_minutes = int(float(s))
-        h = total_minutes // 60
-        m = total_minutes % 60
-        return f"{h}:{m:02d}"
-    except ValueError:
-        return "0:00"
-        
+        if "gcp_json" not in st.secrets: return None
+    except FileNotFoundError: return None  # secrets.toml 自体がない
+    return get_pool(st.secrets["gcp_json"], st.secrets.get("spreadsheet_key"), 'Phase4_Log', get_tracer(TRACE_PATH))
+
+def get_worksheet():
+    pool = get_sheet_pool()
+    if pool is None: raise RuntimeError("Secretsに 'gcp_json' が見つかりません。")
+    return pool.sheet('SleepLog')
+
+@st.cache_resource
+def get_write_queue():
+    # app.py とは別ファイル (プロセスが別でも同じ行を二重に送らない)
+    return WriteQueue(QUEUE_PATH)
+
+@st.cache_resource
+def get_store():
+    # 保存・読み出しはすべてここを通す (app.py と同じ構成)
+    # sqlite / memory: ローカルを正にして SleepLog には get_write_queue のキュー経由でミラー / sheets: キュー経由で SleepLog だけに書く
+    if STORAGE == 'sheets':
+        pool = get_sheet_pool()
+        if pool is None: raise RuntimeError("Secretsに 'gcp_json' が見つかりません。")
+        return SheetsStore(pool, get_write_queue())
+    local = SQLiteStore(STORE_PATH) if STORAGE == 'sqlite' else MemoryStore()
+    return MirroredStore(local, get_write_queue(), get_sheet_pool())
+
+def save_sleep_row(row):
+    # 保存先に date で upsert してすぐ戻る。SleepLog への書き込みはバックグラウンドで date ごとに upsert
+    store = get_store()
+    store.upsert('SleepLog', row)
+    return store.mirror_stats()
+
+def normalize_records(records):
+    # Gemini の抽出結果をまとめて型付き正規化 (列ごとに1回の pandas 演算)
+    # → (SleepLog に書く行のリスト, 読めなかった・範囲外の値の一覧)。問題のある値は空欄で書く
+    typed, issues = normalize_sleep_frame(frame_from_records(records))
+    return to_sheet_values(typed), issues
+
+def show_issues(issues):
+    if len(issues):
+        st.warning(f"⚠️ 読めなかった・範囲外の値が {len(issues)} 件あります (空欄で保存されます)")
+        st.dataframe(issues, hide_index=True, use_container_width=True)
+
+def today_jst():
+    # プロンプトに入れる「今日」(年の読み違いの検証にも使う)
+    return datetime.now(JST).date()
+
+@st.cache_resource
+def get_genai():
+    # google.generativeai は import だけで1秒近くかかるので、最初に解析する時に1回だけ読んで設定する
+    import google.generativeai as genai
+    if "GOOGLE_API_KEY" in st.secrets:
+        genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
+    return genai
+
+def get_model():
+    # モデル設定 (generate_content の所要時間・送受信サイズを記録する)
+    return TracedModel(get_genai().GenerativeModel(MODEL_NAME), get_tracer(TRACE_PATH))
+
+@st.cache_resource
+def get_result_cache():
+    return ResultCache(ANALYSIS_CACHE_DIR, ANALYSIS_CACHE_MAX)
+
+def prepare_images(files):
+    # アップロード画像を前処理したバイト列を返す。結果は session_state に置いて再実行 (rerun) ではデコードし直さない
+    cache = st.session_state.setdefault('_prepared_images', {})
+    settings = (PREPROCESS, PREPROCESS_MAX_DIM, PREPROCESS_FORMAT, PREPROCESS_QUALITY)
+    out, keys = [], set()
+    for f in files:
+        raw = f.getvalue()
+        key = (fingerprint(raw), settings)
+        if key not in cache:
+            data = preprocess_image(raw, PREPROCESS_MAX_DIM, PREPROCESS_FORMAT, PREPROCESS_QUALITY) if PREPROCESS else raw
+            cache[key] = (data, len(raw))
+        keys.add(key)
+        out.append(cache[key])
+    for key in set(cache) - keys: del cache[key]  # 選択から外れた画像は捨てる
+    return [d for d, _ in out], sum(n for _, n in out)
 
 def analyze_images(images):
-    # モデル設定
-    model = genai.GenerativeModel('models/gemini-3-flash-preview')
-    
-    # 2026年固定プロンプト
-    prompt = """
-    睡眠スクショからデータを抽出しJSONで返して。
-    【最重要】現在は2026年1月です。日付の年は必ず「2026」にしてください。
-    項目: date(2026-MM-DD), sleep_score, total_sleep, fall_asleep, wake_up, rem, light, deep, avg_hr, min_hr, max_hr, resting_hr
-    """
-    
-    response = model.generate_content([prompt, *images])
-    res_text = response.text
-    start = res_text.find('{')
-    end = res_text.rfind('}') + 1
-    return json.loads(res_text[start:end])
+    # 全スクショを1回の generate_content で解析 (JSON スキーマ固定) → 検証して問題のある項目だけ聞き直す
+    return extract_record(get_model(), images, today_jst(), parallel=False, max_retries=EXTRACT_RETRIES)
+
+def analyze_images_cached(images):
+    # 1枚ずつ並列に解析 (解析済みの画像・レコードはディスクキャッシュから) → 1レコードにまとめて検証・聞き直し
+    return extract_record(get_model(), images, today_jst(), get_result_cache(), ANALYZE_CONCURRENCY, max_retries=EXTRACT_RETRIES)
+
+def run_backfill(sources, update_existing):
+    # 何晩分ものスクショを1枚ずつ並列に解析 → date ごとにまとめる → 保存先に date でまとめて upsert
+    names, images = [], []
+    for name, raw in sources:
+        names.append(name)
+        images.append(preprocess_image(raw, PREPROCESS_MAX_DIM, PREPROCESS_FORMAT, PREPROCESS_QUALITY) if PREPROCESS else raw)
+    # 何晩分もあるので聞き直しはしない (問題のある値は issues に出して空欄で書く)
+    today = today_jst()
+    prompt = sleep_prompt(today, single_image=True)
+    records, hits = extract_each(get_model(), prompt, images, get_result_cache(), ANALYZE_CONCURRENCY, generation_config())
+    nights, unassigned = group_by_date(names, records)
+    # 年の読み違いなどでありえない日付の晩は書かない (別の日の行を上書きしてしまう)。issues に出す
+    import pandas as pd
+    rejected = []
+    for date, record in list(nights.items()):
+        reason = validate_record(record, today)[1].get('date')
+        if reason:
+            rejected.append({"row": None, "field": "date", "value": date, "reason": f"{reason} (書き込みません)"})
+            del nights[date]
+    rows, issues = normalize_records(nights.values())
+    if rejected: issues = pd.concat([issues, pd.DataFrame(rejected, columns=issues.columns)], ignore_index=True)
+    written, skipped = get_store().upsert_many('SleepLog', rows, update_existing=update_existing) if rows else ([], [])
+    return {"images": len(images), "cache_hits": hits, "written": written, "skipped": skipped, "unassigned": unassigned, "issues": issues}
+
+def normalize_history():
+    # 既存の SleepLog 全体を型付き正規化して、表記をそろえた値を1回の update で書き戻す (読めない値は元のまま残す)
+    from gspread.utils import rowcol_to_a1
+    sheet = get_worksheet()
+    values = sheet.get_all_values()
+    raw = frame_from_values(values)
+    typed, issues = normalize_sleep_frame(raw)
+    if len(raw):
+        rows = to_sheet_values(typed, raw)
+        sheet.update(range_name=f"A2:{rowcol_to_a1(len(raw) + 1, len(SLEEP_SCHEMA))}", values=rows)
+        # 保存先の行も同じ値にそろえる (Sheets には今書いたのでミラーはしない。未同期の日付は保存先の方が新しいので残す)
+        get_store().refresh('SleepLog', rows)
+    return len(raw), issues
 
 # --- UIレイアウト ---
 st.title("🌙 Sleep Analyzer 2026 (UI Fix)")
@@ -81,7 +172,9 @@ st.title("🌙 Sleep Analyzer 2026 (UI Fix)")
 files = st.file_uploader("スクショを選択", accept_multiple_files=True)
 
 if files:
-    images = [Image.open(f) for f in files]
+    image_bytes, raw_bytes = prepare_images(files)
+    if SHOW_IMAGE_BYTES:
+        st.caption(f"画像サイズ: {raw_bytes / 1024:,.0f} KB → {sum(map(len, image_bytes)) / 1024:,.0f} KB ({len(files)} 枚)")
     
     # 🔽 ここでレイアウト変更！ボタンを画像より上に配置 🔽
     st.markdown("---")
@@ -92,9 +185,15 @@ if files:
         if st.button("✨ 解析実行", use_container_width=True):
             with st.spinner("AI解析中..."):
                 try:
-                    result = analyze_images(images)
+                    if ANALYZE_MODE == 'parallel':
+                        result, problems, stats = analyze_images_cached(image_bytes)
+                    else:
+                        result, problems, stats = analyze_images(image_bytes)
                     st.session_state['sleep_data'] = result
-                    st.success("解析成功！")
+                    st.session_state['sleep_issues'] = normalize_records([result])[1]
+                    st.session_state['sleep_problems'] = [{"field": f, "reason": r} for f, r in problems.items()]
+                    notes = ([f"キャッシュ {stats['cache_hits']}/{len(files)} 枚"] if stats['cache_hits'] else []) + ([f"聞き直し {stats['retries']} 回"] if stats['retries'] else [])
+                    st.success("解析成功！" + (f" ({' / '.join(notes)})" if notes else ""))
                 except Exception as e:
                     st.error(f"解析失敗: {e}")
 
@@ -104,13 +203,19 @@ if files:
             if st.button("📝 保存実行", use_container_width=True):
                 with st.spinner("保存中..."):
                     try:
-                        sheet = get_worksheet()
                         d = st.session_state['sleep_data']
-                        row = [d.get(k) for k in ['date', 'sleep_score', 'total_sleep', 'fall_asleep', 'wake_up', 'rem', 'light', 'deep', 'avg_hr', 'min_hr', 'max_hr', 'resting_hr']]
-                        sheet.append_row(row)
-                        st.balloons()
-                        st.success("保存完了！")
-                        del st.session_state['sleep_data']
+                        row = normalize_records([d])[0][0]
+                        # 保存は date で upsert するので、読み違えた日付のまま書くと別の晩の行を上書きしてしまう
+                        date_problem = validate_record(d, today_jst())[1].get('date')
+                        if date_problem or not row[0]:
+                            st.error(f"日付を確認できないので保存しません ({date_problem or '日付がありません'})。スクショを確かめて解析し直してください")
+                        else:
+                            pending, err = save_sleep_row(row)
+                            st.balloons()
+                            st.success(f"保存完了！(未同期 {pending} 件はバックグラウンドで送信)")
+                            if err: st.caption(f"⚠️ 前回の同期エラー (自動で再送します): {err}")
+                            del st.session_state['sleep_data']
+                            st.session_state.pop('sleep_problems', None)
                     except Exception as e:
                         st.error(f"保存エラー: {e}")
 
@@ -118,8 +223,48 @@ if files:
     if 'sleep_data' in st.session_state:
         st.caption("解析結果データ:")
         st.json(st.session_state['sleep_data'])
+        show_issues(st.session_state.get('sleep_issues', []))
+        if st.session_state.get('sleep_problems'):
+            st.warning("⚠️ 聞き直しても確認できなかった項目があります (保存前にスクショと見比べてください)")
+            st.dataframe(st.session_state['sleep_problems'], hide_index=True, use_container_width=True)
 
     # 画像は一番下に追いやる（確認用）
     st.markdown("---")
     with st.expander("アップロードした画像を確認する"):
-        st.image(images, use_container_width=True)
+        st.image(image_bytes, use_container_width=True)
+
+# --- 📦 まとめて取り込み (過去分のバックフィル) ---
+st.markdown("---")
+with st.expander("📦 まとめて取り込み (過去のスクショを一括登録)"):
+    st.caption("何晩分ものスクショを ZIP かサーバー上のフォルダから読み込み、解析した日付ごとにまとめて SleepLog に登録します")
+    zip_file = st.file_uploader("ZIP を選択", type=["zip"], key="backfill_zip")
+    folder = st.text_input("またはフォルダのパス", key="backfill_folder")
+    on_exist = st.radio("SleepLog に既にある日付", ["スキップ", "上書き"], horizontal=True, key="backfill_exist")
+    if st.button("📦 一括取り込み実行", use_container_width=True, disabled=not (zip_file or folder)):
+        with st.spinner("一括解析中..."):
+            try:
+                sources = list(iter_zip_images(zip_file.getvalue())) if zip_file else list(iter_folder_images(folder))
+                report = run_backfill(sources, update_existing=(on_exist == "上書き"))
+                st.success(f"取り込み完了！ {report['images']} 枚 → {len(report['written'])} 日分を登録 (キャッシュ {report['cache_hits']} 枚)")
+                if report['skipped']: st.caption(f"既にある日付をスキップ: {', '.join(report['skipped'])}")
+                if report['unassigned']: st.warning(f"日付が読めなかった画像: {', '.join(report['unassigned'])}")
+                show_issues(report['issues'])
+            except Exception as e:
+                st.error(f"取り込みエラー: {e}")
+
+# --- 🧹 既存データの表記をそろえる ---
+with st.expander("🧹 SleepLog の表記をそろえる"):
+    st.caption("\"0:47\" / 57 / \"1:18:00\" などが混ざった時間の列を H:MM に、スコア・心拍数を整数にそろえて書き戻します (読めない値はそのまま残して一覧表示)")
+    if st.button("🧹 正規化して書き戻す", use_container_width=True):
+        with st.spinner("正規化中..."):
+            try:
+                n, issues = normalize_history()
+                st.success(f"{n} 行を正規化しました")
+                if len(issues):
+                    st.warning(f"⚠️ 読めなかった・範囲外の値が {len(issues)} 件あります (元の値のまま)")
+                    st.dataframe(issues, hide_index=True, use_container_width=True)
+            except Exception as e:
+                st.error(f"正規化エラー: {e}")
+
+startup.finish(get_tracer(TRACE_PATH))
+if debug_enabled(): show_trace_panel(get_tracer(TRACE_PATH), TRACE_CSV_PATH, startup)
@@ -0,0 +1,111 @@
+"""
+Gemini で睡眠スクショから1晩分のレコードを取り出す
+- sleep_prompt      : 今日の年月を入れたプロンプト (年を固定で書かない)
+- generation_config : SLEEP_SCHEMA から作った response_schema 付きの設定 (返答を JSON オブジェクトに固定する)
+- extract_record    : 抽出 → validate_record で検証 → 足りない・おかしい項目だけを max_retries 回まで聞き直す
+"""
+import json
+
+from sleep_schema import SLEEP_SCHEMA, validate_record
+from sleep_vision import extract_each, fingerprint, image_part, merge_records, parse_model_json
+
+MAX_RETRIES = 2  # 聞き直しに使う generate_content の回数の上限
+
+# response_schema の型と書式 (Gemini に渡す説明)
+_SCHEMA_TYPES = {
+    'date': ("string", "日付 YYYY-MM-DD"),
+    'duration': ("string", "長さ H:MM (例 7:12)"),
+    'clock': ("string", "時刻 HH:MM 24時間表記 (例 23:45)"),
+    'int': ("integer", "整数"),
+}
+
+
+def sleep_prompt(today, single_image=False):
+    """today (date) の年月を入れた抽出プロンプト。日単位で変えないので、画像ごとのキャッシュは月が変わるまで使える"""
+    prompt = f"""
+    睡眠スクショからデータを抽出しJSONで返して。
+    【最重要】現在は{today.year}年{today.month}月です。スクショに年が書かれていなければ、今日より未来にならない直近の年にしてください。
+    項目: date(YYYY-MM-DD), sleep_score, total_sleep, fall_asleep, wake_up, rem, light, deep, avg_hr, min_hr, max_hr, resting_hr
+    """
+    if single_image:  # 1枚ずつ解析する時は、写っていない項目を推測させない (他のスクショの値とまとめる)
+        prompt += "    この画像に写っていない項目は null にしてください。\n"
+    return prompt
+
+
+def response_schema(fields):
+    """fields (SLEEP_SCHEMA の一部) → Gemini の response_schema。写っていない項目は null を許す"""
+    properties = {}
+    for field, kind in fields.items():
+        type_, description = _SCHEMA_TYPES[kind]
+        properties[field] = {"type": type_, "description": description, "nullable": True}
+    return {"type": "object", "properties": properties, "required": list(fields)}
+
+
+def generation_config(fields=SLEEP_SCHEMA):
+    return {"response_mime_type": "application/json", "response_schema": response_schema(fields)}
+
+
+def repair_prompt(record, problems, today):
+    """problems の項目だけを読み直させるプロンプト (前回の値と理由を添える)"""
+    lines = [f"    - {field}: 前回 {json.dumps(record.get(field), ensure_ascii=False)} → {reason}" for field, reason in problems.items()]
+    return f"""
+    睡眠スクショからの抽出結果に問題がありました。次の項目だけをスクショから読み直してJSONで返して。
+    現在は{today.year}年{today.month}月です。スクショで読み取れない項目は null にしてください。
+""" + "\n".join(lines) + "\n"
+
+
+def ask(model, prompt, images, config):
+    """全画像を1回の generate_content で聞く。JSON として読めない返答は None"""
+    response = model.generate_content([prompt, *[image_part(b) for b in images]], generation_config=config)
+    try:
+        return parse_model_json(response.text)
+    except ValueError:
+        return None
+
+
+def extract_record(model, images, today, cache=None, max_workers=4, parallel=True, max_retries=MAX_RETRIES):
+    """
+    1晩分のスクショ (画像バイト列のリスト) から1レコードを取り出す。
+    - parallel=True なら1枚ずつ並列に解析してまとめる (画像ごとに cache を使う)。False なら全枚数を1回で解析
+    - validate_record で問題があった項目だけを、その項目に絞ったスキーマで max_retries 回まで聞き直す
+      (問題がなくなる・返答で何も変わらない、のどちらかで打ち切る)
+    - 問題がなくなったレコードは画像の組み合わせごとに cache に入れ、次からはモデルを呼ばない
+    戻り値: (レコード, 残った問題 {field: 理由}, {"calls": generate_content の回数, "cache_hits": キャッシュから読んだ画像数, "retries": 聞き直した回数})
+    """
+    stats = {"calls": 0, "cache_hits": 0, "retries": 0}
+    prompt = sleep_prompt(today, single_image=parallel)
+    config = generation_config()
+    key = None
+    if cache:
+        salt = f"{getattr(model, 'model_name', '')}\n{prompt}\nrecord"
+        key = fingerprint("\n".join(fingerprint(b) for b in images).encode(), salt)
+        record = cache.get(key)
+        if record is not None:
+            stats["cache_hits"] = len(images)
+            return record, validate_record(record, today)[1], stats
+
+    if parallel:
+        results, hits = extract_each(model, prompt, images, cache, max_workers, config)
+        record = merge_records(results)
+        stats["calls"], stats["cache_hits"] = len(images) - hits, hits
+    else:
+        record = ask(model, prompt, images, config) or {}
+        stats["calls"] = 1
+    _, problems = validate_record(record, today)
+
+    while problems and stats["retries"] < max_retries:
+        fields = {f: kind for f, kind in SLEEP_SCHEMA.items() if f in problems}
+        # TracedModel なら何回目の聞き直しかをトレースの retry に残す
+        retry_model = model.with_retry(stats["retries"] + 1) if hasattr(model, "with_retry") else model
+        answer = ask(retry_model, repair_prompt(record, problems, today), images, generation_config(fields)) or {}
+        stats["calls"] += 1
+        stats["retries"] += 1
+        fixed = {f: v for f, v in answer.items() if f in fields and v not in (None, "", "null") and v != record.get(f)}
+        if not fixed:
+            break
+        record = {**record, **fixed}
+        _, problems = validate_record(record, today)
+
+    if key and not problems:
+        cache.put(key, record)
+    return record, problems, stats
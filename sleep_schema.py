@@ -0,0 +1,187 @@
+"""
+SleepLog の型付き正規化
+SLEEP_SCHEMA の型に従って、列ごとに1回の pandas 演算で文字列 → 数値に変換する。
+- duration: 睡眠時間などの長さ → 分 (Int64)      "0:47" / "1:18:00" / 57 / "57.0" / "7時間12分" / "7h 12m"
+- clock   : 入眠・起床などの時刻 → 0時からの分 (Int64)  "23:45" / "6:05:00"
+- int     : スコア・心拍数 (Int64)               80 / "80.0" / "55.5" (平均心拍は小数で出るので四捨五入)
+- date    : 日付 (datetime64)
+読めない値・範囲外の値は "0:00" などに置き換えず、NA にして issues に報告する。
+pandas は変換する関数の中で import する (SLEEP_SCHEMA だけを使う storage などの import を軽くする)。
+"""
+
+SLEEP_SCHEMA = {
+    'date': 'date',
+    'sleep_score': 'int',
+    'total_sleep': 'duration',
+    'fall_asleep': 'clock',
+    'wake_up': 'clock',
+    'rem': 'duration',
+    'light': 'duration',
+    'deep': 'duration',
+    'avg_hr': 'int',
+    'min_hr': 'int',
+    'max_hr': 'int',
+    'resting_hr': 'int',
+}
+
+# 型ごとの許容範囲 (両端含む)。心拍数はフィールド名で個別に指定
+RANGES = {
+    'duration': (0, 24 * 60),
+    'clock': (0, 24 * 60 - 1),
+    'sleep_score': (0, 100),
+    'avg_hr': (20, 250),
+    'min_hr': (20, 250),
+    'max_hr': (20, 250),
+    'resting_hr': (20, 250),
+}
+
+DATE_YEARS = (2000, 2100)  # 年のない日付 ("1/6" など) は 0001 年になるので、この範囲外は読めない値として報告する
+STAGE_FIELDS = ('rem', 'light', 'deep')
+STAGE_TOLERANCE = 15  # レム+浅い+深い と total_sleep の差をどこまで許すか (分)
+MAX_AGE_DAYS = 400  # これより古い日付は年の読み違いとみなす
+
+_HM = r"^(\d{1,3}):(\d{1,2})(?::\d{1,2})?$"
+_JP = r"^(?:(\d+)\s*(?:h|hr|時間))?\s*(?:(\d+)\s*(?:m|min|分))?$"
+
+
+def _text(col):
+    """空文字・None を NA にそろえた文字列列"""
+    s = col.astype("string").str.strip()
+    return s.mask(s.isin(["", "None", "null", "nan", "NaN"]))
+
+
+def _to_minutes(s):
+    """'H:MM' / 'H:MM:SS' / 'xx時間yy分' / 分の数値 を分 (float, 読めなければ NaN) に変換"""
+    import pandas as pd
+    # 整数と小数が混ざると fillna が Int64 と Float64 の間で型変換に失敗するので、先に float64 にそろえる
+    hm = s.str.extract(_HM).apply(pd.to_numeric).astype("float64")
+    from_hm = (hm[0] * 60 + hm[1]).where(hm[1] < 60)
+    jp = s.str.extract(_JP).apply(pd.to_numeric).astype("float64")
+    from_jp = (jp[0].fillna(0) * 60 + jp[1].fillna(0)).where(jp.notna().any(axis=1))
+    num = pd.to_numeric(s, errors="coerce").astype("float64")
+    return from_hm.fillna(from_jp).fillna(num)
+
+
+def _to_int(s):
+    """数値 → 四捨五入した整数 (float, 読めなければ NaN)。round() は偶数丸めで 54.5 → 54 になるので使わない"""
+    import pandas as pd
+    num = pd.to_numeric(s, errors="coerce").astype("float64")
+    return (num + 0.5).floordiv(1)
+
+
+def normalize_sleep_frame(raw):
+    """
+    SLEEP_SCHEMA の列を持つ DataFrame (値は文字列・数値混在でよい) を型付きに変換する。
+    戻り値: (typed, issues)
+      typed : 同じ index の DataFrame。duration / clock は分、int は整数 (どちらも Int64)、date は datetime64
+      issues: 読めなかった・範囲外の値の一覧 (row, field, value, reason)
+    """
+    import pandas as pd
+    typed = pd.DataFrame(index=raw.index)
+    issues = []
+    for field, kind in SLEEP_SCHEMA.items():
+        s = _text(raw[field]) if field in raw else pd.Series(pd.NA, index=raw.index, dtype="string")
+        if kind == 'date':
+            val = pd.to_datetime(s, errors="coerce", format="mixed")
+        elif kind in ('duration', 'clock'):
+            val = _to_minutes(s)
+        else:
+            val = _to_int(s)
+        bad = s.notna() & val.isna()
+        for i in s.index[bad]:
+            issues.append({"row": i, "field": field, "value": s[i], "reason": "読めない値"})
+        if kind == 'date':
+            out = val.notna() & ((val.dt.year < DATE_YEARS[0]) | (val.dt.year > DATE_YEARS[1]))
+            for i in s.index[out]:
+                issues.append({"row": i, "field": field, "value": s[i], "reason": f"範囲外 ({DATE_YEARS[0]}〜{DATE_YEARS[1]}年)"})
+            val = val.mask(out)
+        lo_hi = RANGES.get(field) or RANGES.get(kind)
+        if lo_hi:
+            out = val.notna() & ((val < lo_hi[0]) | (val > lo_hi[1]))
+            for i in s.index[out]:
+                issues.append({"row": i, "field": field, "value": s[i], "reason": f"範囲外 ({lo_hi[0]}〜{lo_hi[1]})"})
+            val = val.mask(out)
+        typed[field] = val if kind == 'date' else val.round().astype("Int64")
+    return typed, pd.DataFrame(issues, columns=["row", "field", "value", "reason"])
+
+
+def frame_from_records(records):
+    """Gemini の抽出結果 (dict のリスト) → SLEEP_SCHEMA 列の DataFrame"""
+    import pandas as pd
+    return pd.DataFrame(list(records), columns=list(SLEEP_SCHEMA))
+
+
+def frame_from_values(values):
+    """SleepLog の get_all_values() (先頭はヘッダー) → SLEEP_SCHEMA 列の DataFrame (列は位置で対応)"""
+    import pandas as pd
+    width = len(SLEEP_SCHEMA)
+    rows = [(list(r) + [""] * width)[:width] for r in values[1:]]
+    return pd.DataFrame(rows, columns=list(SLEEP_SCHEMA))
+
+
+def format_hm(minutes):
+    """分 (Int64) → 'H:MM' 文字列 (NA は NA のまま)"""
+    m = minutes.astype("Int64")
+    return (m // 60).astype("string") + ":" + (m % 60).astype("string").str.zfill(2)
+
+
+def to_sheet_values(typed, raw=None):
+    """
+    型付きの DataFrame を SleepLog に書く値 (行のリスト) に戻す。
+    duration / clock は 'H:MM'、int は整数、date は 'YYYY-MM-DD'。
+    raw を渡すと、読めなかったセルは元の値のまま残す (空欄にして消さない)。
+    """
+    import pandas as pd
+    out = pd.DataFrame(index=typed.index)
+    for field, kind in SLEEP_SCHEMA.items():
+        col = typed[field]
+        if kind == 'date':
+            text = col.dt.strftime("%Y-%m-%d").astype("string")
+        elif kind in ('duration', 'clock'):
+            text = format_hm(col)
+        else:
+            text = col
+        if raw is not None and field in raw:
+            text = text.astype(object).where(col.notna(), _text(raw[field]).astype(object))
+        out[field] = text.astype(object).where(text.notna(), "")
+    return [[v.item() if hasattr(v, "item") else v for v in row] for row in out.itertuples(index=False)]
+
+
+def validate_record(record, today=None):
+    """
+    1晩分の抽出結果 (dict) を型付きに変換して検証する。
+    値の範囲 (normalize_sleep_frame と同じ) に加えて、項目どうしの整合性を見る:
+    - rem + light + deep が total_sleep と STAGE_TOLERANCE 分以内で合う
+    - min_hr <= avg_hr <= max_hr
+    - date が today より未来でなく、MAX_AGE_DAYS 日より古くない (today を渡した時)
+    戻り値: (typed, problems)
+      typed   : {field: 値 (duration / clock は分、int は整数、date は Timestamp、読めなければ None)}
+      problems: {field: 理由} 足りない・読めない・範囲外・整合しない項目
+    """
+    import pandas as pd
+    typed_df, issues = normalize_sleep_frame(frame_from_records([record or {}]))
+    typed = {f: (None if pd.isna(v) else v) for f, v in typed_df.iloc[0].items()}
+    problems = {f: "ありません" for f, v in typed.items() if v is None}
+    for issue in issues.itertuples():
+        problems[issue.field] = f"{issue.reason}: {issue.value}"
+
+    stages = [typed[f] for f in STAGE_FIELDS]
+    total = typed['total_sleep']
+    if total is not None and None not in stages and abs(sum(stages) - total) > STAGE_TOLERANCE:
+        reason = f"レム+浅い+深い ({format_minutes(sum(stages))}) が total_sleep ({format_minutes(total)}) と合いません"
+        for f in ('total_sleep',) + STAGE_FIELDS: problems[f] = reason
+
+    hr = [typed[f] for f in ('min_hr', 'avg_hr', 'max_hr')]
+    if None not in hr and not hr[0] <= hr[1] <= hr[2]:
+        for f in ('min_hr', 'avg_hr', 'max_hr'): problems[f] = f"min_hr <= avg_hr <= max_hr になっていません ({hr[0]} / {hr[1]} / {hr[2]})"
+
+    if today is not None and typed['date'] is not None:
+        day = typed['date'].date()
+        if day > today or (today - day).days > MAX_AGE_DAYS:
+            problems['date'] = f"今日 ({today:%Y-%m-%d}) から見てありえない日付です: {day:%Y-%m-%d}"
+    return typed, problems
+
+
+def format_minutes(minutes):
+    """分 (int) → 'H:MM'"""
+    return f"{int(minutes) // 60}:{int(minutes) % 60:02d}"
@@ -0,0 +1,199 @@
+"""
+睡眠スクショの解析 (Gemini)
+- preprocess_image        : 余白を切り落とし、長辺を縮小して JPEG / WebP に再エンコード
+- ResultCache             : 画像の内容ハッシュ → 抽出結果 をディスクに保存 (LRU で古いものから削除)
+- extract_each            : 未キャッシュの画像だけを1枚ずつ並列に解析し、画像ごとの抽出結果を返す
+- group_by_date           : 何晩分ものスクショ (ZIP / フォルダ) を抽出した date ごとにまとめる
+PIL は画像を開く関数の中で import する (sleep_app.py の最初の描画では読まない)。
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from sleep_schema import SLEEP_SCHEMA
+
+SLEEP_FIELDS = list(SLEEP_SCHEMA)
+
+
+def parse_model_json(text):
+    """モデルの返答から最初の { 〜 最後の } を取り出して JSON として読む (```json のコードブロックで囲まれていてもよい)"""
+    start = text.find('{')
+    end = text.rfind('}') + 1
+    if start < 0 or end <= start:
+        raise ValueError(f"JSON がありません: {text[:100]!r}")
+    parsed = json.loads(text[start:end])
+    if not isinstance(parsed, dict):
+        raise ValueError(f"JSON オブジェクトではありません: {text[:100]!r}")
+    return parsed
+
+
+def preprocess_image(data, max_dim=1280, fmt="JPEG", quality=80, crop=True):
+    """
+    スクショ (バイト列) をモデルに送るサイズに縮める。
+    - crop: 四隅と同じ色の余白 (上下の黒帯・白帯など) を切り落とす
+    - 長辺を max_dim px 以下に縮小 (拡大はしない)
+    - fmt ("JPEG" / "WEBP") で quality を指定して再エンコード
+    """
+    from PIL import Image, ImageChops, ImageOps
+    img = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert("RGB")
+    if crop:
+        bg = Image.new("RGB", img.size, img.getpixel((0, 0)))
+        # 圧縮ノイズ程度の差は背景扱いにする
+        bbox = ImageChops.difference(img, bg).convert("L").point(lambda v: 255 if v > 16 else 0).getbbox()
+        if bbox: img = img.crop(bbox)
+    img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+    out = io.BytesIO()
+    img.save(out, format=fmt, quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def image_part(data):
+    """generate_content に渡す画像パーツ。JPEG / PNG / WebP はバイト列のまま送る (SDK 側で再エンコードさせない)"""
+    if data[:3] == b"\xff\xd8\xff":
+        return {"mime_type": "image/jpeg", "data": data}
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return {"mime_type": "image/png", "data": data}
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return {"mime_type": "image/webp", "data": data}
+    from PIL import Image
+    return Image.open(io.BytesIO(data))
+
+
+def fingerprint(data, salt=""):
+    """画像バイト列 (+ プロンプト・モデル名) の SHA-256"""
+    h = hashlib.sha256(salt.encode())
+    h.update(data)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """1画像 = 1 JSON ファイルのディスクキャッシュ。読むたびに mtime を更新し、max_entries を超えたら古い順に消す"""
+
+    def __init__(self, path, max_entries=500):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.json")
+
+    def get(self, key):
+        try:
+            with open(self._file(key), encoding="utf-8") as fp:
+                result = json.load(fp)
+            os.utime(self._file(key))
+            return result
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, result):
+        tmp = self._file(key) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fp:
+            json.dump(result, fp, ensure_ascii=False)
+        os.replace(tmp, self._file(key))
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = [e for e in os.scandir(self.path) if e.name.endswith(".json")]
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort(key=lambda e: e.stat().st_mtime)
+            for e in entries[:len(entries) - self.max_entries]:
+                try: os.remove(e.path)
+                except OSError: pass
+
+
+def merge_records(records):
+    """
+    スクショごとの部分的な抽出結果を1レコードにまとめる。
+    項目ごとに、アップロード順で最初に見つかった空でない値を採用する。
+    """
+    merged = {}
+    for rec in records:
+        for k, v in (rec or {}).items():
+            if k not in merged and v not in (None, "", "null"):
+                merged[k] = v
+    ordered = {k: merged.pop(k) for k in SLEEP_FIELDS if k in merged}
+    ordered.update(merged)
+    return ordered
+
+
+def extract_each(model, prompt, images, cache=None, max_workers=4, generation_config=None):
+    """
+    images (画像バイト列のリスト) を1枚ずつ解析して、画像ごとの抽出結果のリストを返す。
+    - cache にある画像はモデルを呼ばない
+    - 残りは max_workers 本のスレッドで同時に generate_content を呼ぶ
+    - JSON として読めなかった返答は None にする (キャッシュしない。他の画像の結果は捨てない)
+    戻り値: (抽出結果のリスト, キャッシュヒット数)
+    """
+    salt = f"{getattr(model, 'model_name', '')}\n{prompt}\n{json.dumps(generation_config, sort_keys=True) if generation_config else ''}"
+    keys = [fingerprint(data, salt) for data in images]
+    results = [cache.get(k) if cache else None for k in keys]
+    todo = [i for i, r in enumerate(results) if r is None]
+    kwargs = {"generation_config": generation_config} if generation_config else {}
+
+    def extract(i):
+        response = model.generate_content([prompt, image_part(images[i])], **kwargs)
+        try: return parse_model_json(response.text)
+        except ValueError: return None
+
+    if todo:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(todo)))) as pool:
+            for i, result in zip(todo, pool.map(extract, todo)):
+                results[i] = result
+                if cache and result is not None: cache.put(keys[i], result)
+    return results, len(images) - len(todo)
+
+
+# --- まとめて取り込み (バックフィル) ---
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def iter_zip_images(data):
+    """ZIP (バイト列) の中の画像を (パス, バイト列) で返す"""
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        for info in sorted(zf.infolist(), key=lambda i: i.filename):
+            name = info.filename
+            if info.is_dir() or name.startswith("__MACOSX/") or not name.lower().endswith(IMAGE_EXTS):
+                continue
+            yield name, zf.read(info)
+
+
+def iter_folder_images(path):
+    """フォルダ (サブフォルダ含む) の中の画像を (相対パス, バイト列) で返す"""
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in sorted(names):
+            if name.lower().endswith(IMAGE_EXTS):
+                full = os.path.join(root, name)
+                with open(full, "rb") as fp:
+                    yield os.path.relpath(full, path), fp.read()
+
+
+def group_by_date(names, records):
+    """
+    画像ごとの抽出結果を date でまとめて {date: 1晩分のレコード} にする。
+    date が読めなかった画像は、同じフォルダの画像の date が1つに決まればそれに入れる。
+    戻り値: ({date: レコード}, どの日付にも入らなかった画像名のリスト)
+    """
+    folder_dates = {}
+    for name, rec in zip(names, records):
+        if (rec or {}).get("date"):
+            folder_dates.setdefault(os.path.dirname(name), set()).add(str(rec["date"]))
+    groups, unassigned = {}, []
+    for name, rec in zip(names, records):
+        date = (rec or {}).get("date")
+        if not date:
+            candidates = folder_dates.get(os.path.dirname(name), set())
+            if len(candidates) != 1:
+                unassigned.append(name)
+                continue
+            date = next(iter(candidates))
+        groups.setdefault(str(date), []).append(rec or {})
+    return {d: merge_records(recs) | {"date": d} for d, recs in sorted(groups.items())}, unassigned
@@ -0,0 +1,82 @@
+"""
+起動時間の計測 (app.py / sleep_app.py 共通)
+プロセス開始 (コンテナの起動・アイドルからの復帰) から最初の描画 (1回目のスクリプト実行の終わり) までを区間に分けて記録する。
+- StartupTimer.mark   : 前の区切りからここまでを1区間として記録 (最初の描画が済んだ後は何もしない)
+- StartupTimer.finish : 最初の描画で確定して、tracing.Tracer に kind="startup" で書き、標準エラーに1行出す
+- get_timer           : アプリごとに StartupTimer をプロセス内で1つだけ作る
+重い import や認証はこのモジュールでは行わない (app.py / sleep_app.py の最初に import する)。
+"""
+import os
+import sys
+import threading
+import time
+
+_IMPORTED = time.time()
+
+
+def process_start():
+    """このプロセスが始まった時刻 (UNIX 秒)。/proc が読めない環境ではこのモジュールを最初に import した時刻"""
+    try:
+        with open("/proc/self/stat") as fp:
+            fields = fp.read().rsplit(")", 1)[1].split()  # 2番目の (コマンド名) に空白が入ることがあるので ) の後ろから数える
+        with open("/proc/uptime") as fp:
+            uptime = float(fp.read().split()[0])
+        return time.time() - uptime + int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return _IMPORTED
+
+
+class StartupTimer:
+    """1つのアプリの起動区間。プロセスの最初のスクリプト実行の間だけ記録する"""
+
+    def __init__(self, app, start=None):
+        self.app = app
+        self.start = process_start() if start is None else start
+        self.phases = []  # (区間名, 開始, 終了)
+        self.done = False
+        self._last = self.start
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        with self._lock:
+            if self.done:
+                return
+            now = time.time()
+            self.phases.append((phase, self._last, now))
+            self._last = now
+
+    def finish(self, tracer=None, phase="first_paint"):
+        """最初の描画で呼ぶ。2回目以降 (別セッション・再実行) は何もしない"""
+        self.mark(phase)
+        with self._lock:
+            if self.done:
+                return
+            self.done = True
+        for name, t0, t1 in self.phases:
+            if tracer is not None:
+                tracer.record({
+                    "ts": t0, "session": "startup", "kind": "startup", "target": self.app, "op": name,
+                    "ms": round((t1 - t0) * 1000, 2), "sent": 0, "received": 0, "error": None, "retry": 0,
+                })
+        print(f"[startup] {self.app}: " + " / ".join(f"{r['phase']} {r['ms']:.0f}ms" for r in self.report()) + f" (total {self.total_ms():.0f}ms)", file=sys.stderr)
+
+    def total_ms(self):
+        return (self.phases[-1][2] - self.start) * 1000 if self.phases else 0.0
+
+    def report(self):
+        """区間ごとの 所要時間 (ms) と プロセス開始からの経過 (ms)"""
+        return [
+            {"phase": name, "ms": round((t1 - t0) * 1000, 1), "since_start_ms": round((t1 - self.start) * 1000, 1)}
+            for name, t0, t1 in self.phases
+        ]
+
+
+_timers = {}
+_timers_lock = threading.Lock()
+
+
+def get_timer(app):
+    with _timers_lock:
+        if app not in _timers:
+            _timers[app] = StartupTimer(app)
+        return _timers[app]
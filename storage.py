@@ -0,0 +1,396 @@
+"""
+保存先 (ストレージ) の切り替え
+ルーティーン (v2)・食事 (mealrecord)・睡眠 (SleepLog) の行を、シート名と date (A列) をキーにして読み書きする。
+- SQLiteStore  : ローカルの SQLite (sheet, date) を主キーにした upsert。読み書きは Sheets を待たない
+- MemoryStore  : 同じインターフェースのメモリ上の実装 (オフラインのテスト・ベンチ用)
+- MirroredStore: ローカルに書いてすぐ戻り、Google Sheets には書き込みキュー経由で非同期にミラーする
+                 ローカルにまだないシートは、最初に触った時に Sheets から1回だけ取り込む
+- SheetsStore  : Google Sheets を直接の保存先にする (その場で書くか、書き込みキュー経由で書く)
+どれも has / header / get / recent / upsert / upsert_many / seed で読み書きする。
+アプリが使う MirroredStore と SheetsStore は、さらに refresh / resume_sync / mirror_stats を持つ。
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from sheets_io import CountingSheet, RowWriter, read_tail, upsert_by_date
+from sleep_schema import SLEEP_SCHEMA
+from write_queue import start_worker
+
+# ローカルにヘッダーがまだない (Sheets から取り込んでいない) シートで使うヘッダー
+# v2 は展開前の A〜I 列だけ (J〜R 列が展開済みかは Sheets のヘッダーを読むまで分からない)
+DEFAULT_HEADERS = {
+    "v2": ["Date", "WakeTime", "Workout", "", "", "WorkoutTime", "BedTime", "Progress", "Diary"],
+    "mealrecord": ["DATE", "BREAKFAST", "LUNCH", "DINNER", "SUPPLEMENTS"],
+    "SleepLog": list(SLEEP_SCHEMA),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    sheet TEXT NOT NULL,
+    date TEXT NOT NULL,
+    row TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (sheet, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS headers (
+    sheet TEXT PRIMARY KEY,
+    header TEXT NOT NULL
+);
+"""
+
+
+def _table(header, rows):
+    """[header, *rows] をいちばん長い行の幅にそろえる (取り込んだ古い行は J〜R 列がないなど)"""
+    width = max([len(header)] + [len(r) for r in rows])
+    return [list(r) + [""] * (width - len(r)) for r in [header] + rows]
+
+
+class MemoryStore:
+    """{sheet: {date: row}} をメモリに持つだけの実装"""
+
+    def __init__(self):
+        self._rows = {}
+        self._headers = {}
+        self._lock = threading.Lock()
+
+    def has(self, sheet):
+        """Sheets から取り込み済み (ヘッダーを持っている) か"""
+        return sheet in self._headers
+
+    def header(self, sheet):
+        return list(self._headers.get(sheet) or DEFAULT_HEADERS.get(sheet, []))
+
+    def get(self, sheet, date):
+        row = self._rows.get(sheet, {}).get(date)
+        return list(row) if row is not None else None
+
+    def recent(self, sheet, n):
+        """[header, *date の新しい n 行 (古い順)]。幅はそろえて返す"""
+        with self._lock:
+            rows = self._rows.get(sheet, {})
+            dates = sorted(rows)[-n:] if n else []
+            return _table(self.header(sheet), [rows[d] for d in dates])
+
+    def upsert(self, sheet, row, value_input_option="RAW"):
+        with self._lock:
+            self._rows.setdefault(sheet, {})[str(row[0])] = list(row)
+
+    def upsert_many(self, sheet, rows, value_input_option="RAW", update_existing=True):
+        """value_input_option は Sheets にミラーする時だけ使う。戻り値: (書き込んだ date のリスト, スキップした date のリスト)"""
+        written, skipped = [], []
+        with self._lock:
+            table = self._rows.setdefault(sheet, {})
+            for row in rows:
+                date = str(row[0])
+                if date in table and not update_existing:
+                    skipped.append(date)
+                    continue
+                table[date] = list(row)
+                written.append(date)
+        return written, skipped
+
+    def seed(self, sheet, header, rows):
+        """Sheets から読んだ行を取り込む。ローカルに既にある date はローカルの方が新しいので上書きしない"""
+        with self._lock:
+            self._headers[sheet] = list(header)
+            table = self._rows.setdefault(sheet, {})
+            for row in rows:
+                if row and row[0] and str(row[0]) not in table:
+                    table[str(row[0])] = list(row)
+
+
+class SQLiteStore:
+    """
+    (sheet, date) を主キーにした SQLite のテーブル。date の検索・upsert は索引で1回のクエリ。
+    接続は1本をロックで共有する (Streamlit のセッションごとのスレッドから呼ばれる)。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.executescript(_SCHEMA)
+
+    def has(self, sheet):
+        with self._lock:
+            return self._con.execute("SELECT 1 FROM headers WHERE sheet = ?", (sheet,)).fetchone() is not None
+
+    def header(self, sheet):
+        with self._lock:
+            found = self._con.execute("SELECT header FROM headers WHERE sheet = ?", (sheet,)).fetchone()
+        return json.loads(found[0]) if found else list(DEFAULT_HEADERS.get(sheet, []))
+
+    def get(self, sheet, date):
+        with self._lock:
+            found = self._con.execute("SELECT row FROM rows WHERE sheet = ? AND date = ?", (sheet, date)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def recent(self, sheet, n):
+        """[header, *date の新しい n 行 (古い順)]。幅はそろえて返す"""
+        with self._lock:
+            found = self._con.execute(
+                "SELECT row FROM rows WHERE sheet = ? ORDER BY date DESC LIMIT ?", (sheet, n)
+            ).fetchall()
+        return _table(self.header(sheet), [json.loads(r) for r, in reversed(found)])
+
+    def upsert(self, sheet, row, value_input_option="RAW"):
+        self.upsert_many(sheet, [row], value_input_option)
+
+    def upsert_many(self, sheet, rows, value_input_option="RAW", update_existing=True):
+        """戻り値: (書き込んだ date のリスト, 既にあってスキップした date のリスト)"""
+        now = time.time()
+        params = [(sheet, str(r[0]), json.dumps(list(r), ensure_ascii=False), now) for r in rows]
+        with self._lock:
+            con = self._con
+            con.execute("BEGIN")
+            try:
+                if update_existing:
+                    skipped = []
+                else:
+                    dates = [p[1] for p in params]
+                    existing = {d for d, in con.execute(
+                        f"SELECT date FROM rows WHERE sheet = ? AND date IN ({','.join('?' * len(dates))})",
+                        [sheet, *dates],
+                    )} if dates else set()
+                    skipped = [p[1] for p in params if p[1] in existing]
+                    params = [p for p in params if p[1] not in existing]
+                con.executemany(
+                    "INSERT INTO rows (sheet, date, row, updated) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (sheet, date) DO UPDATE SET row = excluded.row, updated = excluded.updated",
+                    params,
+                )
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+        return [p[1] for p in params], skipped
+
+    def seed(self, sheet, header, rows):
+        """Sheets から読んだ行を取り込む。ローカルに既にある date はローカルの方が新しいので上書きしない"""
+        params = [(sheet, str(r[0]), json.dumps(list(r), ensure_ascii=False), 0) for r in rows if r and r[0]]
+        with self._lock:
+            con = self._con
+            con.execute("BEGIN")
+            try:
+                con.execute(
+                    "INSERT INTO headers (sheet, header) VALUES (?, ?) "
+                    "ON CONFLICT (sheet) DO UPDATE SET header = excluded.header",
+                    (sheet, json.dumps(list(header), ensure_ascii=False)),
+                )
+                con.executemany("INSERT OR IGNORE INTO rows (sheet, date, row, updated) VALUES (?, ?, ?, ?)", params)
+                con.execute("COMMIT")
+            except Exception:
+                con.execute("ROLLBACK")
+                raise
+
+
+class MirroredStore:
+    """
+    local (SQLiteStore / MemoryStore) を正として読み書きし、書き込みは WriteQueue に積んで
+    FlushWorker が Google Sheets に date ごとに upsert する (Sheets 側が落ちていても保存は止まらない)。
+    pool (sheets_io.SheetPool) がなければミラーせずにキューに溜めるだけ。
+    """
+
+    HYDRATE_RETRY = 60  # Sheets からの取り込みに失敗したら、この秒数は再試行しない
+
+    def __init__(self, local, queue=None, pool=None):
+        self.local = local
+        self.queue = queue
+        self.pool = pool
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._failed = {}
+
+    def hydrate(self, sheet):
+        """ローカルにまだないシートを Sheets から1回だけ取り込む (get_all_values 1回)"""
+        if self.pool is None or self.local.has(sheet):
+            return
+        with self._lock:
+            if self.local.has(sheet) or time.time() - self._failed.get(sheet, 0) < self.HYDRATE_RETRY:
+                return
+            try:
+                values = self.pool.sheet(sheet).get_all_values()
+            except Exception as e:  # オフラインでもローカルだけで動かす
+                self._failed[sheet] = time.time()
+                self.last_error = e
+                return
+            if values:
+                self.local.seed(sheet, values[0], values[1:])
+
+    def has(self, sheet):
+        return self.local.has(sheet)
+
+    def header(self, sheet):
+        self.hydrate(sheet)
+        return self.local.header(sheet)
+
+    def get(self, sheet, date):
+        self.hydrate(sheet)
+        return self.local.get(sheet, date)
+
+    def recent(self, sheet, n):
+        self.hydrate(sheet)
+        return self.local.recent(sheet, n)
+
+    def upsert(self, sheet, row, value_input_option="RAW"):
+        self.upsert_many(sheet, [row], value_input_option)
+
+    def upsert_many(self, sheet, rows, value_input_option="RAW", update_existing=True):
+        """
+        キュー (Sheets へのミラー) に積んでからローカルに書く。local と queue は別の SQLite ファイルなので、
+        逆の順だと間で落ちた時に「ローカルにだけあって Sheets に送られない行」が残り、後から気づく手段がない。
+        この順なら、落ちても保存はエラーになり (やり直せばローカルにも入る)、キューの行は Sheets に届く。
+        """
+        self.hydrate(sheet)
+        skipped = []
+        if not update_existing:
+            skipped = [str(r[0]) for r in rows if self.local.get(sheet, str(r[0])) is not None]
+            rows = [r for r in rows if str(r[0]) not in set(skipped)]
+        if self.queue is not None:
+            for row in rows: self.queue.enqueue(sheet, str(row[0]), row, value_input_option)
+        written, _ = self.local.upsert_many(sheet, rows)
+        if self.queue is not None and written and self.pool is not None:
+            start_worker(self.queue, self.pool).notify()
+        return written, skipped
+
+    def seed(self, sheet, header, rows):
+        self.local.seed(sheet, header, rows)
+
+    def refresh(self, sheet, rows):
+        """Sheets に直接書き戻した行 (正規化など) をローカルにもそろえる。未同期の日付はローカルの方が新しいので残す"""
+        pending = self.queue.rows(sheet) if self.queue is not None else {}
+        self.local.upsert_many(sheet, [r for r in rows if r and r[0] and str(r[0]) not in pending])
+
+    def resume_sync(self):
+        """前回のプロセスで残った未同期分も送り始める"""
+        if self.queue is not None and self.pool is not None:
+            start_worker(self.queue, self.pool)
+
+    def mirror_stats(self):
+        """(Sheets に未同期の件数, 最後の同期エラー)"""
+        return self.queue.stats() if self.queue is not None else (0, None)
+
+
+class SheetsStore:
+    """
+    Google Sheets のシートをそのまま保存先にする。date → 行番号 は pool (sheets_io.SheetPool) の RowIndex から引く。
+    - queue がなければその場で書く。1行の保存は RowWriter (diff モードなら変わった列だけ)、複数行は upsert_by_date の1回の batch_update
+    - queue があれば WriteQueue に積んですぐ戻り、FlushWorker が date ごとに upsert する (読み出しには未同期の行を重ねて返す)
+    recent の末尾の読み出しは cache_ttl 秒だけ全セッションで使い回す。このプロセスから書いた時と、
+    キューの行が Sheets に書けた時 (WriteQueue.version が進んだ時) には捨てて読み直す
+    (未同期の間は重ねて返せるが、同期して消えた後にキャッシュの古い末尾を返すと今日の行が抜ける)。
+    """
+
+    def __init__(self, pool, queue=None, write_mode="batch", cache_ttl=0.0):
+        self.pool = pool
+        self.queue = queue
+        self.write_mode = write_mode
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        self._tails = {}  # sheet → (読んだ時刻, 行数, WriteQueue.version, header, rows)
+        self._writers = {}  # (sheet, value_input_option) → RowWriter (diff モードで前回書いた行を覚えておく)
+
+    def has(self, sheet):
+        return True  # Sheets そのものなので取り込むものはない
+
+    def header(self, sheet):
+        with self._lock:
+            cached = self._tails.get(sheet)
+        return list(cached[3]) if cached else self.pool.sheet(sheet).row_values(1)
+
+    def get(self, sheet, date):
+        if self.queue is not None:
+            pending = self.queue.get(sheet, date)
+            if pending is not None:
+                return pending
+        ws, index = self.pool.sheet(sheet), self.pool.index(sheet)
+        index.ensure(ws)
+        idx = index.find(date)
+        return ws.row_values(idx) if idx else None
+
+    def recent(self, sheet, n):
+        """[header, *シート末尾の n 行程度]。未同期の行があれば同じ date の行と置き換えて末尾に足す"""
+        header, rows = self._tail(sheet, n)
+        pending = self.queue.rows(sheet) if self.queue is not None else {}
+        if pending:
+            rows = [r for r in rows if str(r[0]) not in pending] + [[str(v) for v in r] for r in pending.values()]
+        return _table(header, rows)
+
+    def _tail(self, sheet, n):
+        version = self.queue.version(sheet) if self.queue is not None else 0  # 読む前に見る (読んでいる間の同期は次で読み直す)
+        with self._lock:
+            cached = self._tails.get(sheet)
+            if cached and cached[1] >= n and cached[2] == version and time.time() - cached[0] < self.cache_ttl:
+                return cached[3], cached[4]
+        header, rows, start_row = read_tail(self.pool.sheet(sheet), n)
+        index = self.pool.index(sheet)
+        if not index.built: index.build([r[0] for r in rows], start_row)
+        with self._lock:
+            self._tails[sheet] = (time.time(), n, version, header, rows)
+        return header, rows
+
+    def invalidate(self, sheet=None):
+        """recent のキャッシュを捨てる (sheet を省くと全シート)"""
+        with self._lock:
+            if sheet is None: self._tails.clear()
+            else: self._tails.pop(sheet, None)
+
+    def upsert(self, sheet, row, value_input_option="RAW"):
+        """戻り値: その場で書いた時は API 呼び出し回数 (キュー経由なら None)"""
+        if self.queue is not None:
+            self.upsert_many(sheet, [row], value_input_option)
+            return None
+        with self._lock:
+            writer = self._writers.setdefault((sheet, value_input_option), RowWriter(self.write_mode, value_input_option))
+        ws, index, date = CountingSheet(self.pool.sheet(sheet)), self.pool.index(sheet), str(row[0])
+        try:
+            index.ensure(ws)
+            idx = index.find(date)
+            if not index.check(ws, {idx or index.next_row: date if idx else ""}):
+                # 手入力・他の端末からの追記で行がずれていた → A列を読み直した索引で書く
+                writer.forget(); index.ensure(ws); idx = index.find(date)
+            if not idx:
+                # append_row は使わず次の行に書く (右側に何があってもA列から書ける)
+                idx = index.next_row
+                if idx > ws.row_count: ws.add_rows(idx - ws.row_count)  # グリッドの外には書けない
+            writer.write_row(ws, idx, row)
+            index.add(date, idx)
+        except Exception:
+            writer.forget(); index.invalidate()
+            raise
+        finally:
+            self.invalidate(sheet)  # 他セッションの起動時復元に古いデータを渡さない
+        return ws.calls
+
+    def upsert_many(self, sheet, rows, value_input_option="RAW", update_existing=True):
+        """戻り値: (書き込んだ (キューに積んだ) date のリスト, 既にあってスキップした date のリスト)"""
+        if self.queue is None:
+            try:
+                return upsert_by_date(self.pool.sheet(sheet), self.pool.index(sheet), rows, value_input_option, update_existing)
+            finally:
+                self.invalidate(sheet)
+        skipped = []
+        if not update_existing:
+            skipped = [str(r[0]) for r in rows if self.get(sheet, str(r[0])) is not None]
+            rows = [r for r in rows if str(r[0]) not in set(skipped)]
+        for row in rows: self.queue.enqueue(sheet, str(row[0]), row, value_input_option)
+        if rows: start_worker(self.queue, self.pool).notify()
+        return [str(r[0]) for r in rows], skipped
+
+    def seed(self, sheet, header, rows):
+        self.invalidate(sheet)  # シートが正なので取り込むものはない (ヘッダーが変わったので読み直させる)
+
+    def refresh(self, sheet, rows):
+        self.invalidate(sheet)
+
+    def resume_sync(self):
+        if self.queue is not None:
+            start_worker(self.queue, self.pool)
+
+    def mirror_stats(self):
+        """(Sheets に未同期の件数, 最後の同期エラー)"""
+        return self.queue.stats() if self.queue is not None else (0, None)
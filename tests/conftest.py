@@ -0,0 +1,5 @@
+import os
+import sys
+
+# アプリのモジュールはリポジトリ直下に平置き
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,85 @@
+"""extract_record の聞き直しとキャッシュを fakes.StubModel に対して動かす (全画像を1回で聞く parallel=False)"""
+import datetime
+
+from fakes import StubModel
+from sleep_extract import extract_record
+from sleep_vision import ResultCache
+
+TODAY = datetime.date(2026, 1, 10)
+IMAGES = [b"\xff\xd8\xff night 1", b"\xff\xd8\xff night 1 (2)"]  # JPEG として PIL を通さずに送られる
+GOOD = {
+    'date': '2026-01-06', 'sleep_score': 80, 'total_sleep': '7:12', 'fall_asleep': '23:45', 'wake_up': '7:00',
+    'rem': '1:30', 'light': '4:30', 'deep': '1:12', 'avg_hr': 55, 'min_hr': 48, 'max_hr': 70, 'resting_hr': 50,
+}
+
+
+def is_repair(parts):
+    return "問題がありました" in parts[0]
+
+
+def extract(model, **kwargs):
+    return extract_record(model, IMAGES, TODAY, parallel=False, **kwargs)
+
+
+def test_clean_record_needs_one_call():
+    model = StubModel(GOOD)
+    record, problems, stats = extract(model)
+    assert record == GOOD and problems == {}
+    assert stats == {"calls": 1, "cache_hits": 0, "retries": 0}
+
+
+def test_repair_asks_only_flagged_fields():
+    def reply(parts):
+        if not is_repair(parts):
+            return {**GOOD, 'avg_hr': None}
+        return {'avg_hr': 56, 'date': '2020-01-01'}  # 聞いていない date は採用しない
+
+    model = StubModel(reply)
+    record, problems, stats = extract(model)
+    assert problems == {} and record['avg_hr'] == 56 and record['date'] == '2026-01-06'
+    assert stats == {"calls": 2, "cache_hits": 0, "retries": 1}
+    first, repair = model.configs
+    assert len(first["response_schema"]["properties"]) == 12
+    assert list(repair["response_schema"]["properties"]) == ['avg_hr']
+    assert repair["response_schema"]["required"] == ['avg_hr']
+
+
+def test_repair_stops_at_max_retries():
+    model = StubModel()
+
+    def reply(parts):
+        if not is_repair(parts):
+            return {**GOOD, 'deep': '3:00'}
+        return {'deep': f"3:{model.calls:02d}"}  # 毎回値は変わるが合計は合わないまま
+
+    model.reply = reply
+    record, problems, stats = extract(model, max_retries=2)
+    assert stats == {"calls": 3, "cache_hits": 0, "retries": 2}
+    assert set(problems) == {'total_sleep', 'rem', 'light', 'deep'}
+    assert record['deep'] == "3:03"
+
+    model.calls = 0
+    _, _, stats = extract(model, max_retries=0)
+    assert stats["retries"] == 0 and model.calls == 1
+
+
+def test_repair_stops_when_reply_changes_nothing():
+    model = StubModel({**GOOD, 'deep': '3:00'})  # 聞き直しても同じ値を返す
+    _, problems, stats = extract(model, max_retries=5)
+    assert stats == {"calls": 2, "cache_hits": 0, "retries": 1}
+    assert 'deep' in problems
+
+
+def test_only_clean_records_are_cached(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    model = StubModel(GOOD)
+    extract(model, cache=cache)
+    record, problems, stats = extract(model, cache=cache)
+    assert record == GOOD and problems == {}
+    assert model.calls == 1 and stats == {"calls": 0, "cache_hits": 2, "retries": 0}
+
+    bad = StubModel({**GOOD, 'sleep_score': 120}, model_name="models/other")
+    extract(bad, cache=cache, max_retries=0)
+    _, problems, stats = extract(bad, cache=cache, max_retries=0)
+    assert 'sleep_score' in problems
+    assert bad.calls == 2 and stats["cache_hits"] == 0  # 問題の残ったレコードは毎回聞き直す
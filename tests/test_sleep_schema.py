@@ -0,0 +1,83 @@
+"""sleep_schema の型付き正規化 (文字列 → 分・整数・日付 → SleepLog に書く値)"""
+import datetime
+
+import pandas as pd
+
+from sleep_schema import SLEEP_SCHEMA, frame_from_records, frame_from_values, normalize_sleep_frame, to_sheet_values, validate_record
+
+GOOD = {
+    'date': '2026-01-06', 'sleep_score': 80, 'total_sleep': '7:12', 'fall_asleep': '23:45', 'wake_up': '7:00',
+    'rem': '1:30', 'light': '4:30', 'deep': '1:12', 'avg_hr': 55, 'min_hr': 48, 'max_hr': 70, 'resting_hr': 50,
+}
+
+
+def test_mixed_duration_formats_become_minutes():
+    raw = frame_from_records([
+        {**GOOD, 'total_sleep': '0:47'},
+        {**GOOD, 'total_sleep': '57.5'},
+        {**GOOD, 'total_sleep': '7時間12分'},
+        {**GOOD, 'total_sleep': '1:18:00'},
+        {**GOOD, 'total_sleep': 57},
+        {**GOOD, 'total_sleep': '7h 12m'},
+    ])
+    typed, issues = normalize_sleep_frame(raw)
+    assert typed['total_sleep'].tolist() == [47, 58, 432, 78, 57, 432]
+    assert str(typed['total_sleep'].dtype) == "Int64"
+    assert typed['fall_asleep'].iloc[0] == 23 * 60 + 45
+    assert issues.empty
+
+
+def test_bad_values_become_na_and_are_reported():
+    raw = frame_from_records([
+        {**GOOD, 'total_sleep': 'abc', 'wake_up': '7:75', 'sleep_score': '120', 'min_hr': ''},
+        {**GOOD, 'date': '1/6'},
+    ])
+    typed, issues = normalize_sleep_frame(raw)
+    assert list(issues.columns) == ["row", "field", "value", "reason"]
+    found = {(r.row, r.field): (r.value, r.reason) for r in issues.itertuples()}
+    assert found == {
+        (0, 'total_sleep'): ('abc', "読めない値"),
+        (0, 'wake_up'): ('7:75', "読めない値"),
+        (0, 'sleep_score'): ('120', "範囲外 (0〜100)"),
+        (1, 'date'): ('1/6', "範囲外 (2000〜2100年)"),  # 年のない日付は 0001 年になる
+    }
+    assert typed.loc[0, ['total_sleep', 'wake_up', 'sleep_score', 'min_hr']].isna().all()  # 空欄は報告しないが NA
+    assert pd.isna(typed.loc[1, 'date']) and typed.loc[1, 'sleep_score'] == 80
+
+
+def test_fractional_heart_rate_is_rounded_half_up():
+    typed, issues = normalize_sleep_frame(frame_from_records([
+        {**GOOD, 'avg_hr': '55.5'}, {**GOOD, 'avg_hr': '54.5'}, {**GOOD, 'avg_hr': 55.0},
+    ]))
+    assert typed['avg_hr'].tolist() == [56, 55, 55]
+    assert issues.empty
+
+
+def test_sheet_values_round_trip_and_keep_unreadable_cells():
+    values = [
+        list(SLEEP_SCHEMA),
+        ['2026-01-06', '80', '7時間12分', '23:45:00', '7:00', '90', '4:30', '1:12', '55', '48', '70', '50'],
+        ['2026/01/07', '81.0', 'abc', '', '6:05', '1:30', '4:30', '1:12', '56', '47', '', '49'],
+    ]
+    raw = frame_from_values(values)
+    typed, issues = normalize_sleep_frame(raw)
+    rows = to_sheet_values(typed, raw)
+    assert rows == [
+        ['2026-01-06', 80, '7:12', '23:45', '7:00', '1:30', '4:30', '1:12', 55, 48, 70, 50],
+        ['2026-01-07', 81, 'abc', '', '6:05', '1:30', '4:30', '1:12', 56, 47, '', 49],
+    ]
+    assert [type(v) for v in rows[0][8:]] == [int] * 4  # numpy の整数のまま Sheets に渡さない
+    # 書き戻した値をもう一度読んでも同じ値になる
+    again, _ = normalize_sleep_frame(frame_from_values([values[0]] + rows))
+    pd.testing.assert_frame_equal(again, typed)
+    assert to_sheet_values(typed)[1][2] == ''  # raw を渡さなければ読めないセルは空欄
+
+
+def test_validate_record_checks_consistency_and_date():
+    today = datetime.date(2026, 1, 10)
+    typed, problems = validate_record(GOOD, today)
+    assert problems == {} and typed['total_sleep'] == 432
+    _, problems = validate_record({**GOOD, 'deep': '3:00', 'min_hr': 60, 'date': '2026-01-11'}, today)
+    assert set(problems) == {'total_sleep', 'rem', 'light', 'deep', 'min_hr', 'avg_hr', 'max_hr', 'date'}
+    _, problems = validate_record({k: v for k, v in GOOD.items() if k != 'date'}, today)
+    assert problems == {'date': "ありません"}
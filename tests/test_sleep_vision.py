@@ -0,0 +1,55 @@
+"""extract_each と ResultCache を fakes.StubModel とディスク上の一時フォルダに対して動かす"""
+import os
+
+from fakes import StubModel
+from sleep_vision import ResultCache, extract_each, merge_records
+
+PROMPT = "睡眠スクショからデータを抽出しJSONで返して。"
+
+
+def jpeg(name):
+    return b"\xff\xd8\xff" + name.encode()  # JPEG として PIL を通さずに送られる
+
+
+def test_malformed_reply_is_none_and_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    images = [jpeg("score"), jpeg("broken"), jpeg("hr")]
+    replies = {b"score": {"sleep_score": 80}, b"broken": "すみません、読めませんでした", b"hr": '```json\n{"avg_hr": 55}\n```'}
+    model = StubModel(lambda parts: replies[parts[1]["data"][3:]])
+
+    results, hits = extract_each(model, PROMPT, images, cache)
+    assert results == [{"sleep_score": 80}, None, {"avg_hr": 55}] and hits == 0
+    assert merge_records(results) == {"sleep_score": 80, "avg_hr": 55}  # 他の画像の結果は捨てない
+
+    results, hits = extract_each(model, PROMPT, images, cache)
+    assert hits == 2 and model.calls == 4  # 読めなかった画像だけもう一度聞く
+    assert len([n for n in os.listdir(tmp_path) if n.endswith(".json")]) == 2
+
+
+def test_cache_key_depends_on_prompt_and_model(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    model = StubModel({"sleep_score": 80})
+    extract_each(model, PROMPT, [jpeg("a")], cache)
+    assert extract_each(model, PROMPT, [jpeg("a")], cache)[1] == 1
+    assert extract_each(model, PROMPT + "2026年1月", [jpeg("a")], cache)[1] == 0
+    assert extract_each(StubModel({}, model_name="models/other"), PROMPT, [jpeg("a")], cache)[1] == 0
+    assert model.calls == 2
+
+
+def test_result_cache_evicts_least_recently_read(tmp_path):
+    cache = ResultCache(str(tmp_path), max_entries=2)
+    cache.put("old", {"n": 1})
+    cache.put("new", {"n": 2})
+    os.utime(tmp_path / "old.json", (1, 1))
+    os.utime(tmp_path / "new.json", (2, 2))
+    assert cache.get("old") == {"n": 1}  # 読むと mtime が今になり、new より後まで残る
+    cache.put("newest", {"n": 3})
+    assert cache.get("new") is None
+    assert cache.get("old") == {"n": 1} and cache.get("newest") == {"n": 3}
+    assert cache.get("missing") is None
+
+
+def test_result_cache_ignores_broken_files(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    (tmp_path / "broken.json").write_text("{", encoding="utf-8")
+    assert cache.get("broken") is None
@@ -0,0 +1,141 @@
+"""storage の保存先を Sheets なし (MemoryStore / SQLiteStore) と fakes.FakeClient に対して動かす"""
+import pytest
+
+from fakes import FakeClient
+from sheets_io import SheetPool
+from storage import DEFAULT_HEADERS, MemoryStore, MirroredStore, SheetsStore, SQLiteStore
+from write_queue import FlushWorker, WriteQueue
+
+HEADER = ["DATE", "BREAKFAST", "LUNCH", "DINNER", "SUPPLEMENTS"]
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def local(request, tmp_path):
+    return MemoryStore() if request.param == "memory" else SQLiteStore(str(tmp_path / "local.sqlite3"))
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WriteQueue(str(tmp_path / "pending.sqlite3"))
+
+
+def make_pool(client):
+    return SheetPool({}, spreadsheet_key=FakeClient.KEY, client_factory=lambda creds: client)
+
+
+def test_upsert_replaces_row_with_same_date(local):
+    local.upsert("mealrecord", ["2026-01-02", "a"])
+    local.upsert("mealrecord", ["2026-01-01", "b"])
+    local.upsert("mealrecord", ["2026-01-02", "c"])
+    assert local.get("mealrecord", "2026-01-02") == ["2026-01-02", "c"]
+    assert local.get("mealrecord", "2026-01-03") is None
+    # 新しい n 行を古い順に、ヘッダーの幅にそろえて返す
+    assert local.recent("mealrecord", 1) == [DEFAULT_HEADERS["mealrecord"], ["2026-01-02", "c", "", "", ""]]
+    assert [r[0] for r in local.recent("mealrecord", 5)[1:]] == ["2026-01-01", "2026-01-02"]
+
+
+def test_upsert_many_can_skip_existing_dates(local):
+    local.upsert("SleepLog", ["2026-01-01", "80"])
+    written, skipped = local.upsert_many("SleepLog", [["2026-01-01", "90"], ["2026-01-02", "70"]], update_existing=False)
+    assert (written, skipped) == (["2026-01-02"], ["2026-01-01"])
+    assert local.get("SleepLog", "2026-01-01") == ["2026-01-01", "80"]
+
+
+def test_seed_does_not_overwrite_local_rows(local):
+    assert not local.has("mealrecord")
+    local.upsert("mealrecord", ["2026-01-02", "local"])
+    local.seed("mealrecord", HEADER, [["2026-01-01", "sheet"], ["2026-01-02", "sheet"], ["", "blank"]])
+    assert local.has("mealrecord") and local.header("mealrecord") == HEADER
+    assert local.get("mealrecord", "2026-01-01") == ["2026-01-01", "sheet"]
+    assert local.get("mealrecord", "2026-01-02") == ["2026-01-02", "local"]
+    assert local.get("mealrecord", "") is None
+
+
+def test_mirrored_enqueues_before_local_write(local, queue):
+    def broken(*args, **kwargs):
+        raise OSError("disk full")
+
+    local.upsert_many = broken
+    store = MirroredStore(local, queue)
+    with pytest.raises(OSError):
+        store.upsert("mealrecord", ["2026-01-02", "a"])
+    # ローカルに書けなくても、キューの行は Sheets に送られる
+    assert queue.get("mealrecord", "2026-01-02") == ["2026-01-02", "a"]
+
+
+def test_mirrored_skips_existing_dates_without_enqueueing(local, queue):
+    store = MirroredStore(local, queue)
+    store.upsert("SleepLog", ["2026-01-01", "80"])
+    written, skipped = store.upsert_many("SleepLog", [["2026-01-01", "90"], ["2026-01-02", "70"]], update_existing=False)
+    assert (written, skipped) == (["2026-01-02"], ["2026-01-01"])
+    assert queue.get("SleepLog", "2026-01-01") == ["2026-01-01", "80"]
+    assert store.mirror_stats() == (2, None)
+
+
+def test_mirrored_hydrates_once_and_waits_before_retrying(local, queue, monkeypatch):
+    client = FakeClient({"mealrecord": [HEADER, ["2026-01-01", "sheet"]]})
+    pool = make_pool(client)
+    store = MirroredStore(local, queue, pool)
+    ws = client.worksheets["mealrecord"]
+    read = ws.get_all_values
+
+    def offline():
+        raise OSError("offline")
+
+    ws.get_all_values = offline
+    assert store.get("mealrecord", "2026-01-01") is None  # オフラインでもローカルだけで動く
+    assert isinstance(store.last_error, OSError)
+
+    ws.get_all_values = read
+    assert store.get("mealrecord", "2026-01-01") is None  # HYDRATE_RETRY 秒は再試行しない
+    monkeypatch.setattr(MirroredStore, "HYDRATE_RETRY", 0)
+    assert store.get("mealrecord", "2026-01-01")[:2] == ["2026-01-01", "sheet"]
+    calls = len(ws.log)
+    store.recent("mealrecord", 5)
+    assert len(ws.log) == calls  # 取り込んだ後は Sheets を読まない
+
+
+def test_mirrored_refresh_keeps_pending_dates(local, queue):
+    store = MirroredStore(local, queue)
+    store.upsert("SleepLog", ["2026-01-02", "70"])
+    store.refresh("SleepLog", [["2026-01-01", "80"], ["2026-01-02", "60"]])
+    assert store.get("SleepLog", "2026-01-01") == ["2026-01-01", "80"]
+    assert store.get("SleepLog", "2026-01-02") == ["2026-01-02", "70"]
+
+
+def test_sheets_store_writes_rows_in_place():
+    client = FakeClient({"mealrecord": [HEADER, ["2026-01-01", "a", "", "", ""]]})
+    store = SheetsStore(make_pool(client), write_mode="diff")
+    store.upsert("mealrecord", ["2026-01-02", "b", "", "", ""])
+    assert store.upsert("mealrecord", ["2026-01-02", "b", "c", "", ""]) == 2  # A列の確認 + 変わった列だけ
+    written, skipped = store.upsert_many("mealrecord", [["2026-01-01", "x"], ["2026-01-03", "y"]], update_existing=False)
+    assert (written, skipped) == (["2026-01-03"], ["2026-01-01"])
+    data = client.worksheets["mealrecord"].data
+    assert [r[:3] for r in data[1:]] == [["2026-01-01", "a", ""], ["2026-01-02", "b", "c"], ["2026-01-03", "y"]]
+    assert store.get("mealrecord", "2026-01-02")[:3] == ["2026-01-02", "b", "c"]
+
+
+def test_sheets_store_overlays_pending_rows_and_caches_tail(queue):
+    client = FakeClient({"mealrecord": [HEADER, ["2026-01-01", "a"], ["2026-01-02", "old"]]})
+    store = SheetsStore(make_pool(client), queue, cache_ttl=60)
+    queue.enqueue("mealrecord", "2026-01-02", ["2026-01-02", "new"])
+    rows = store.recent("mealrecord", 10)
+    assert rows[0] == HEADER and [r[:2] for r in rows[1:]] == [["2026-01-01", "a"], ["2026-01-02", "new"]]
+    assert store.get("mealrecord", "2026-01-02") == ["2026-01-02", "new"]
+    calls = len(client.worksheets["mealrecord"].log)
+    store.recent("mealrecord", 10)
+    assert len(client.worksheets["mealrecord"].log) == calls  # cache_ttl の間は読み直さない
+
+
+def test_sheets_store_rereads_tail_after_flush(queue):
+    client = FakeClient({"mealrecord": [HEADER, ["2026-01-01", "a"]]})
+    pool = make_pool(client)
+    store = SheetsStore(pool, queue, cache_ttl=60)
+    store.recent("mealrecord", 10)  # 保存前に別のセッションが読んだ末尾
+    queue.enqueue("mealrecord", "2026-01-02", ["2026-01-02", "today"])
+    assert store.recent("mealrecord", 10)[-1][:2] == ["2026-01-02", "today"]  # 未同期の行を重ねる
+
+    FlushWorker(queue, pool).flush_once()
+    assert queue.get("mealrecord", "2026-01-02") is None
+    # キューから消えた後も、キャッシュの古い末尾ではなく読み直した末尾に今日の行がある
+    assert store.recent("mealrecord", 10)[-1][:2] == ["2026-01-02", "today"]
@@ -0,0 +1,136 @@
+"""WriteQueue / FlushWorker を fakes.FakeClient に対して動かす (スレッドは起動せず flush_once を直接呼ぶ)"""
+import time
+
+import pytest
+
+from fakes import FakeClient, quota_error
+from sheets_io import SheetPool
+from tracing import Tracer
+from write_queue import FlushWorker, WriteQueue
+
+HEADER = ["date", "sleep_score"]
+
+
+@pytest.fixture
+def client():
+    return FakeClient({"SleepLog": [HEADER, ["2026-01-01", "80"]]})
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WriteQueue(str(tmp_path / "pending.sqlite3"))
+
+
+def make_worker(client, queue, tracer=None, **kwargs):
+    pool = SheetPool({}, spreadsheet_key=FakeClient.KEY, client_factory=lambda creds: client, tracer=tracer)
+    return FlushWorker(queue, pool, **kwargs)
+
+
+def rows_for(client, date):
+    return [r for r in client.worksheets["SleepLog"].data if r and r[0] == date]
+
+
+def test_reenqueue_during_flush_keeps_newer_row(client, queue):
+    worker = make_worker(client, queue)
+    ws = client.worksheets["SleepLog"]
+    send = ws.batch_update
+
+    def batch_update(data, **kwargs):
+        # 書き込み中に同じ日付がもう一度保存された
+        queue.enqueue("SleepLog", "2026-01-02", ["2026-01-02", "90"])
+        return send(data, **kwargs)
+
+    queue.enqueue("SleepLog", "2026-01-02", ["2026-01-02", "70"])
+    ws.batch_update = batch_update
+    assert worker.flush_once() == 1
+    assert queue.get("SleepLog", "2026-01-02") == ["2026-01-02", "90"]  # rev が違うので消えない
+
+    ws.batch_update = send
+    worker.flush_once()
+    assert queue.stats() == (0, None)
+    assert rows_for(client, "2026-01-02") == [["2026-01-02", "90"]]
+
+
+def test_retries_after_quota_error(client, queue):
+    worker = make_worker(client, queue, base_delay=0.0)
+    ws = client.worksheets["SleepLog"]
+    send = ws.batch_update
+    failures = [quota_error()]
+
+    def batch_update(data, **kwargs):
+        if failures: raise failures.pop()
+        return send(data, **kwargs)
+
+    ws.batch_update = batch_update
+    queue.enqueue("SleepLog", "2026-01-02", ["2026-01-02", "70"])
+    assert worker.flush_once() == 0
+    count, err = queue.stats()
+    assert count == 1 and "429" in err
+    assert [e.attempts for e in queue.due(now=time.time() + 1)] == [1]
+    assert rows_for(client, "2026-01-02") == []
+
+    assert worker.flush_once() == 1
+    assert queue.stats() == (0, None)
+    assert rows_for(client, "2026-01-02") == [["2026-01-02", "70"]]
+
+
+def test_resend_is_traced_as_retry(client, queue):
+    tracer = Tracer()
+    worker = make_worker(client, queue, tracer=tracer, base_delay=0.0)
+    ws = client.worksheets["SleepLog"]
+    send = ws.batch_update
+    failures = [quota_error()]
+
+    def batch_update(data, **kwargs):
+        if failures: raise failures.pop()
+        return send(data, **kwargs)
+
+    ws.batch_update = batch_update
+    queue.enqueue("SleepLog", "2026-01-02", ["2026-01-02", "70"])
+    worker.flush_once()
+    worker.flush_once()
+    sends = [e for e in tracer.events() if e["op"] == "batch_update"]
+    assert [(e["retry"], e["error"] is None) for e in sends] == [(0, False), (1, True)]
+
+
+def test_backoff_delays_next_try(client, queue):
+    worker = make_worker(client, queue, base_delay=60.0)
+
+    def batch_update(data, **kwargs):
+        raise quota_error()
+
+    client.worksheets["SleepLog"].batch_update = batch_update
+    queue.enqueue("SleepLog", "2026-01-02", ["2026-01-02", "70"])
+    worker.flush_once()
+    assert queue.due() == []
+    assert worker.flush_once() == 0  # 再送待ちの間は送らない
+
+
+def test_resending_same_date_does_not_duplicate(client, queue):
+    worker = make_worker(client, queue)
+    queue.enqueue("SleepLog", "2026-01-02", ["2026-01-02", "70"])
+    worker.flush_once()
+    queue.enqueue("SleepLog", "2026-01-02", ["2026-01-02", "75"])
+    worker.flush_once()
+    # 別プロセス (索引なし) から同じ行をもう一度送っても追記されない
+    queue.enqueue("SleepLog", "2026-01-02", ["2026-01-02", "75"])
+    make_worker(client, queue).flush_once()
+    assert rows_for(client, "2026-01-02") == [["2026-01-02", "75"]]
+    assert len(client.worksheets["SleepLog"].data) == 3
+
+
+def test_synced_calls_belong_to_the_saved_rev(client, queue):
+    worker = make_worker(client, queue)
+    rev = queue.enqueue("SleepLog", "2026-01-02", ["2026-01-02", "70"])
+    assert queue.synced_calls("SleepLog", "2026-01-02", rev) is None  # まだ同期していない
+    worker.flush_once()
+    calls = queue.synced_calls("SleepLog", "2026-01-02", rev)
+    assert calls == worker.last_calls > 0
+
+    worker.flush_once()  # 送る行のないポーリングでは数え直さない
+    assert worker.last_calls == calls
+
+    # 同期済みの日付をもう一度保存すると rev は続きから振られ、同期するまでは None
+    newer = queue.enqueue("SleepLog", "2026-01-02", ["2026-01-02", "75"])
+    assert newer > rev and queue.rev("SleepLog", "2026-01-02") == newer
+    assert queue.synced_calls("SleepLog", "2026-01-02", newer) is None
@@ -0,0 +1,183 @@
+"""
+Sheets / Gemini 呼び出しのトレース
+- Tracer      : 呼び出しごとに 開始時刻・セッション・種類・対象・操作・所要時間 (ms)・送受信バイト・エラー・やり直し回数 を記録する
+                メモリには直近 max_events 件、path を渡すと JSONL に追記 (CSV にも書き出せる)
+- TracedModel : GenerativeModel の generate_content を計測するプロキシ
+- set_session : これ以降にこのスレッドで作るプロキシ・呼び出しに付けるセッション ID
+SheetPool (sheets_io) に tracer を渡すと、ワークシートの全メソッドとスプレッドシートを開く呼び出しが記録される。
+"""
+import csv
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+
+FIELDS = ["ts", "session", "kind", "target", "op", "ms", "sent", "received", "error", "retry"]
+# Sheets API の読み取りクォータに数える操作 (それ以外のワークシートのメソッドは書き込み)
+READ_OPS = {
+    "get_all_values", "get_all_records", "get_values", "col_values", "row_values", "get", "batch_get",
+    "acell", "cell", "find", "findall", "open", "open_by_key", "worksheets", "connect",
+}
+
+_local = threading.local()
+
+
+def set_session(session):
+    _local.session = session
+
+
+def current_session():
+    return getattr(_local, "session", None) or "background"
+
+
+def payload_size(obj):
+    """送受信したデータのおおよそのバイト数 (文字列は UTF-8、数値は8バイト、画像はバイト列の長さ)"""
+    if obj is None:
+        return 0
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, str):
+        return len(obj.encode())
+    if isinstance(obj, (bool, int, float)):
+        return 8
+    if isinstance(obj, dict):
+        return sum(payload_size(k) + payload_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(payload_size(v) for v in obj)
+    try:
+        text = obj.text  # Gemini の返答
+    except Exception:
+        return 0
+    return payload_size(text) if isinstance(text, str) else 0
+
+
+def _error_text(e):
+    code = getattr(e, "code", None)
+    return f"{type(e).__name__}{f' {code}' if isinstance(code, int) else ''}: {e}"[:300]
+
+
+class Tracer:
+    """スレッドセーフな呼び出しの記録係。プロセスに1つ (get_tracer) を両アプリ・書き込みスレッドで共有する"""
+
+    def __init__(self, path=None, max_events=5000, max_bytes=5 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._events = deque(maxlen=max_events)
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def call(self, kind, target, op, fn, args=(), kwargs=None, retry=0, session=None):
+        """fn(*args, **kwargs) を実行して記録する。例外も記録してそのまま投げ直す"""
+        kwargs = kwargs or {}
+        start = time.time()
+        t0 = time.perf_counter()
+        result, error = None, None
+        try:
+            result = fn(*args, **kwargs)
+            return result
+        except Exception as e:
+            error = _error_text(e)
+            raise
+        finally:
+            self.record({
+                "ts": start, "session": session or current_session(), "kind": kind, "target": target, "op": op,
+                "ms": round((time.perf_counter() - t0) * 1000, 2),
+                "sent": payload_size(args) + payload_size(kwargs), "received": payload_size(result),
+                "error": error, "retry": retry,
+            })
+
+    def record(self, event):
+        with self._lock:
+            self._events.append(event)
+            if self.path:
+                try:
+                    self._rotate()
+                    with open(self.path, "a", encoding="utf-8") as fp:
+                        fp.write(json.dumps(event, ensure_ascii=False) + "\n")
+                except OSError:  # 記録できなくても呼び出し自体は止めない
+                    pass
+
+    def _rotate(self):
+        try:
+            if os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+        except OSError:
+            pass
+
+    def events(self, session=None):
+        with self._lock:
+            return [e for e in self._events if session is None or e["session"] == session]
+
+    def summary(self, session=None):
+        """(種類, 対象, 操作) ごとの 回数・エラー・やり直し・中央値/p95/最大 (ms)・送受信バイト合計"""
+        groups = {}
+        for e in self.events(session):
+            groups.setdefault((e["kind"], e["target"], e["op"]), []).append(e)
+        out = []
+        for (kind, target, op), es in sorted(groups.items()):
+            ms = sorted(e["ms"] for e in es)
+            out.append({
+                "kind": kind, "target": target, "op": op, "calls": len(es),
+                "errors": sum(1 for e in es if e["error"]), "retries": sum(1 for e in es if e["retry"]),
+                "p50_ms": ms[len(ms) // 2], "p95_ms": ms[min(len(ms) - 1, int(len(ms) * 0.95))], "max_ms": ms[-1],
+                "sent": sum(e["sent"] for e in es), "received": sum(e["received"] for e in es),
+            })
+        return out
+
+    def quota(self, window=60.0, now=None):
+        """直近 window 秒の Sheets の読み取り・書き込み回数と 429 (クォータ超過) の回数 (プロセス全体)"""
+        since = (time.time() if now is None else now) - window
+        recent = [e for e in self.events() if e["kind"] == "sheets" and e["ts"] >= since]
+        reads = sum(1 for e in recent if e["op"] in READ_OPS)
+        return {"read": reads, "write": len(recent) - reads, "rate_limited": sum(1 for e in recent if " 429:" in (e["error"] or ""))}
+
+    def to_csv(self, path=None, session=None):
+        """記録を CSV にする。path を渡せばファイルに書き、なければ文字列で返す"""
+        buf = io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(self.events(session))
+        if path is None:
+            return buf.getvalue()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", newline="", encoding="utf-8") as fp:
+            fp.write(buf.getvalue())
+        return path
+
+
+class TracedModel:
+    """generate_content を Tracer に記録する GenerativeModel のプロキシ (作ったスレッドのセッションで記録)"""
+
+    def __init__(self, model, tracer, retry=0):
+        self._model = model
+        self._tracer = tracer
+        self._session = current_session()
+        self.retry = retry
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+    def with_retry(self, retry):
+        """retry 回目の聞き直しとして記録する同じモデルのプロキシ"""
+        traced = TracedModel(self._model, self._tracer, retry)
+        traced._session = self._session
+        return traced
+
+    def generate_content(self, contents, **kwargs):
+        target = getattr(self._model, "model_name", "gemini")
+        return self._tracer.call("gemini", target, "generate_content", self._model.generate_content, (contents,), kwargs, self.retry, self._session)
+
+
+_tracers = {}
+_tracers_lock = threading.Lock()
+
+
+def get_tracer(path=None):
+    """path (JSONL の書き出し先) ごとに Tracer をプロセス内で1つだけ作る"""
+    with _tracers_lock:
+        if path not in _tracers:
+            _tracers[path] = Tracer(path)
+        return _tracers[path]
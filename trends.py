@@ -0,0 +1,131 @@
+"""
+トレンド分析用の日次フレーム
+SleepLog / v2 / mealrecord を日付で結合した1日1行の列指向フレームを作り、
+7日・30日の移動平均を列として持たせて Parquet スナップショットに保存する。
+次回はスナップショットの最終日以降の行だけを Sheets から読み、移動平均も新しい日の分だけ計算し直す。
+
+日付のそろえ方: SleepLog の date は起床日なので、1日前にずらして「その晩 (= v2 の BedTime の日)」に合わせる。
+"""
+import os
+
+import pandas as pd
+
+from routine_log import ROUTINE_KEYS, completion_rate, load_routine_log
+from sheets_io import read_tail
+from sleep_schema import frame_from_values, normalize_sleep_frame
+
+BEDTIME_TOLERANCE = 30  # 就寝目標から何分以内の入眠を「守れた」とするか
+WINDOWS = (7, 30)
+ROLLING_COLUMNS = ["sleep_score", "deep", "rem", "completion_rate", "bedtime_kept"]
+FETCH_TAIL_ROWS = 60
+
+
+def _frame(header, rows):
+    headers = [h if (h and h.strip()) else f"COL_{i}" for i, h in enumerate(header)]
+    return pd.DataFrame(rows, columns=headers)
+
+
+def sleep_daily(header, rows):
+    """SleepLog の行 → その晩の日付ごとの睡眠の列 (分・整数に正規化済み)"""
+    typed, _ = normalize_sleep_frame(frame_from_values([header] + rows))
+    typed = typed.dropna(subset=["date"])
+    typed["date"] = typed["date"] - pd.Timedelta(days=1)
+    return typed.drop_duplicates("date", keep="last").set_index("date")
+
+
+def routine_daily(header, rows):
+    """v2 の行 → 日付ごとの完了数・完了率・就寝目標 (J〜R 列があれば列演算だけで作る)"""
+    if "Date" not in header:
+        return pd.DataFrame()
+    log = load_routine_log(header, rows)
+    return pd.DataFrame({
+        "routine_done": log[ROUTINE_KEYS].notna().sum(axis=1).astype("Int64"),
+        "completion_rate": completion_rate(log),
+        "bed_target": log["bed_target"],
+    })
+
+
+def meal_daily(header, rows):
+    """mealrecord の行 → 日付ごとの記録した食事の数"""
+    df = _frame(header, rows)
+    if "DATE" not in df:
+        return pd.DataFrame()
+    meals = [c for c in ("BREAKFAST", "LUNCH", "DINNER") if c in df]
+    out = pd.DataFrame({
+        "date": pd.to_datetime(df["DATE"], errors="coerce", format="mixed"),
+        "meals_logged": df[meals].apply(lambda c: c.astype(str).str.strip() != "").sum(axis=1).astype("Int64"),
+    })
+    return out.dropna(subset=["date"]).drop_duplicates("date", keep="last").set_index("date")
+
+
+def join_daily(sleep, routine, meal):
+    """3つのシートの日次フレームを日付で外部結合し、就寝目標との差を足す"""
+    daily = pd.concat([sleep, routine, meal], axis=1).sort_index()
+    daily.index.name = "date"
+    if "fall_asleep" in daily and "bed_target" in daily:
+        # 目標からの遅れ (分)。日付またぎを考えて -12時間〜+12時間 に折り返す
+        delay = (daily["fall_asleep"] - daily["bed_target"] + 720) % 1440 - 720
+        daily["bedtime_delay"] = delay.astype("Int64")
+        daily["bedtime_kept"] = (delay <= BEDTIME_TOLERANCE).astype("Float64").where(delay.notna())
+    return daily
+
+
+def add_rolling(daily, since=None):
+    """
+    7日・30日の移動平均列 ({col}_{n}d) を足す。
+    since 以降の行だけ計算し直す (それより前の行は前回の値をそのまま使う)。
+    """
+    cols = [c for c in ROLLING_COLUMNS if c in daily]
+    lookback = pd.Timedelta(days=max(WINDOWS) - 1)
+    start = None if since is None else since - lookback
+    part = daily if start is None else daily[daily.index >= start]
+    for n in WINDOWS:
+        rolled = part[cols].astype("float64").rolling(f"{n}D", min_periods=1).mean()
+        for c in cols:
+            name = f"{c}_{n}d"
+            if name not in daily:
+                daily[name] = pd.Series(float("nan"), index=daily.index)
+            target = rolled.index if since is None else rolled.index[rolled.index >= since]
+            daily.loc[target, name] = rolled.loc[target, c]
+    return daily
+
+
+def load_snapshot(path):
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path)
+
+
+def save_snapshot(daily, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    daily.to_parquet(tmp)
+    os.replace(tmp, path)
+
+
+def _read_since(sheet, since):
+    header, rows, _ = read_tail(sheet, FETCH_TAIL_ROWS, since=since)
+    if since is not None:
+        rows = [r for r in rows if str(r[0]) >= since]
+    return header, rows
+
+
+def refresh(pool, path, sleep_title="SleepLog", routine_title="v2", meal_title="mealrecord"):
+    """
+    スナップショットを読み、最終日以降の行だけを各シートから読んで結合・移動平均を更新して保存する。
+    最終日はその日のうちに書き換わるので、最終日の行も読み直して置き換える。
+    """
+    snap = load_snapshot(path)
+    last = None if snap is None or snap.empty else snap.index.max()
+    since = None if last is None else last.strftime("%Y-%m-%d")
+    # SleepLog の date は翌朝なので1日ずらして読む
+    sleep_since = None if last is None else (last + pd.Timedelta(days=1)).strftime("%Y-%m-%d")
+    sleep = sleep_daily(*_read_since(pool.sheet(sleep_title), sleep_since))
+    routine = routine_daily(*_read_since(pool.sheet(routine_title), since))
+    meal = meal_daily(*_read_since(pool.sheet(meal_title), since))
+    fresh = join_daily(sleep, routine, meal)
+    # 最終日より前はスナップショットの行 (移動平均込み) をそのまま使い、最終日以降を読み直した行で置き換える
+    daily = fresh if snap is None else pd.concat([snap[snap.index < last], fresh]).sort_index()
+    daily = add_rolling(daily, since=last)
+    save_snapshot(daily, path)
+    return daily
@@ -0,0 +1,75 @@
+import streamlit as st
+import os
+import time
+from sheets_io import get_pool
+from trends import BEDTIME_TOLERANCE, load_snapshot, refresh
+
+# 🚀 ページ設定
+st.set_page_config(page_title="Phase 4 Trends", page_icon="📈", layout="centered")
+
+# ⚙️ 設定
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+SNAPSHOT_PATH = os.path.join(APP_DIR, '.cache', 'trends.parquet')
+SNAPSHOT_TTL = 600  # スナップショットがこの秒数より新しければ Sheets を読まない
+
+def get_sheet_pool():
+    # クライアント・ワークシートは sheets_io でプロセス内共有 (app.py / sleep_app.py と共通)
+    return get_pool(st.secrets["gcp_json"], st.secrets.get("spreadsheet_key"), 'Phase4_Log')
+
+def load_daily(force=False):
+    # 新しいスナップショットがあればそれだけ読む。古ければ最終日以降の行だけを Sheets から読んで更新
+    if not force and os.path.exists(SNAPSHOT_PATH) and time.time() - os.path.getmtime(SNAPSHOT_PATH) < SNAPSHOT_TTL:
+        return load_snapshot(SNAPSHOT_PATH)
+    return refresh(get_sheet_pool(), SNAPSHOT_PATH)
+
+# --- UIレイアウト ---
+st.title("📈 Phase 4 Trends")
+
+c1, c2 = st.columns(2)
+with c1:
+    force = st.button("🔄 最新の行を読み込む", use_container_width=True)
+with c2:
+    if st.button("♻️ スナップショットを作り直す", use_container_width=True):
+        if os.path.exists(SNAPSHOT_PATH): os.remove(SNAPSHOT_PATH)
+        force = True
+
+try:
+    with st.spinner("読み込み中..."):
+        daily = load_daily(force)
+except Exception as e:
+    st.error(f"読み込みエラー: {e}")
+    st.stop()
+
+if daily is None or daily.empty:
+    st.info("まだデータがありません")
+    st.stop()
+
+st.caption(f"{daily.index.min():%Y-%m-%d} 〜 {daily.index.max():%Y-%m-%d} ({len(daily)} 日) / スナップショット更新: {time.strftime('%m-%d %H:%M', time.localtime(os.path.getmtime(SNAPSHOT_PATH)))}")
+
+latest = daily.iloc[-1]
+m1, m2, m3, m4 = st.columns(4)
+def metric(col, label, key, fmt):
+    val7, val30 = latest.get(f"{key}_7d"), latest.get(f"{key}_30d")
+    if val7 is None or val7 != val7: col.metric(label, "--"); return
+    col.metric(label, fmt(val7), None if val30 != val30 else fmt(val7 - val30), help="7日平均 (差分は30日平均との比較)")
+metric(m1, "😴 睡眠スコア", "sleep_score", lambda v: f"{v:.1f}")
+metric(m2, "🌊 深い睡眠", "deep", lambda v: f"{v:.0f}分")
+metric(m3, "✅ ルーティン完了率", "completion_rate", lambda v: f"{v:.0%}")
+metric(m4, "🛏️ 就寝目標達成", "bedtime_kept", lambda v: f"{v:.0%}")
+
+st.markdown("### 😴 Sleep Score")
+st.line_chart(daily[[c for c in ["sleep_score_7d", "sleep_score_30d"] if c in daily]])
+
+st.markdown("### 🌊 Deep / REM (分, 7日平均)")
+st.line_chart(daily[[c for c in ["deep_7d", "rem_7d"] if c in daily]])
+
+st.markdown("### ✅ ルーティン完了率")
+st.line_chart(daily[[c for c in ["completion_rate_7d", "completion_rate_30d"] if c in daily]])
+
+st.markdown(f"### 🛏️ 就寝目標からの遅れ (分, {BEDTIME_TOLERANCE}分以内なら達成)")
+if "bedtime_delay" in daily:
+    st.bar_chart(daily["bedtime_delay"].astype("float64").tail(60))
+    st.line_chart(daily[[c for c in ["bedtime_kept_7d", "bedtime_kept_30d"] if c in daily]])
+
+with st.expander("日次データ"):
+    st.dataframe(daily.sort_index(ascending=False), use_container_width=True)
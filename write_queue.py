@@ -0,0 +1,227 @@
+"""
+保存キュー (write-ahead queue) & バックグラウンド同期
+- WriteQueue : 保存したい行を SQLite に即記録する。同じ (シート, 日付) は最新の行で上書き
+- FlushWorker: 別スレッドでキューを Google Sheets に書き出す
+               シートごとに1回の batch_update、失敗時は指数バックオフで再送、日付で upsert (冪等)
+"""
+import json
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from sheets_io import CountingSheet, upsert_by_date
+
+PendingRow = namedtuple("PendingRow", "sheet date row value_input_option rev attempts")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    sheet TEXT NOT NULL,
+    date TEXT NOT NULL,
+    row TEXT NOT NULL,
+    value_input_option TEXT NOT NULL,
+    rev INTEGER NOT NULL DEFAULT 1,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_try REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    PRIMARY KEY (sheet, date)
+);
+CREATE TABLE IF NOT EXISTS synced (
+    sheet TEXT NOT NULL,
+    date TEXT NOT NULL,
+    rev INTEGER NOT NULL,
+    calls INTEGER NOT NULL,
+    PRIMARY KEY (sheet, date)
+)
+"""
+
+
+class WriteQueue:
+    """SQLite に置いた未同期行のキュー。プロセスが落ちても次の起動で続きから同期できる"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        with self._connect() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.executescript(_SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def enqueue(self, sheet, date, row, value_input_option="RAW"):
+        """
+        (sheet, date) の行を記録して rev を返す。未同期の同じ日付があれば上書きして rev を進める
+        (rev は同期済みの rev の続きから振るので、同じ日付の保存ごとに増え続ける)
+        """
+        with self._lock, self._connect() as con:
+            con.execute(
+                """
+                INSERT INTO pending (sheet, date, row, value_input_option, rev)
+                VALUES (?, ?, ?, ?, COALESCE((SELECT rev FROM synced WHERE sheet = ? AND date = ?), 0) + 1)
+                ON CONFLICT (sheet, date) DO UPDATE SET
+                    row = excluded.row, value_input_option = excluded.value_input_option,
+                    rev = rev + 1, attempts = 0, next_try = 0, last_error = NULL
+                """,
+                (sheet, date, json.dumps(list(row), ensure_ascii=False), value_input_option, sheet, date),
+            )
+            return con.execute("SELECT rev FROM pending WHERE sheet = ? AND date = ?", (sheet, date)).fetchone()[0]
+
+    def get(self, sheet, date):
+        """未同期の (sheet, date) の行があれば返す"""
+        with self._lock, self._connect() as con:
+            found = con.execute("SELECT row FROM pending WHERE sheet = ? AND date = ?", (sheet, date)).fetchone()
+        return json.loads(found[0]) if found else None
+
+    def rows(self, sheet):
+        """未同期の sheet の行を {date: 行} で返す (date 順)"""
+        with self._lock, self._connect() as con:
+            found = con.execute("SELECT date, row FROM pending WHERE sheet = ? ORDER BY date", (sheet,)).fetchall()
+        return {d: json.loads(r) for d, r in found}
+
+    def due(self, now=None, limit=500):
+        """再送待ち時間を過ぎた行を返す"""
+        now = time.time() if now is None else now
+        with self._lock, self._connect() as con:
+            rows = con.execute(
+                "SELECT sheet, date, row, value_input_option, rev, attempts FROM pending "
+                "WHERE next_try <= ? ORDER BY sheet, date LIMIT ?",
+                (now, limit),
+            ).fetchall()
+        return [PendingRow(s, d, json.loads(r), v, rev, a) for s, d, r, v, rev, a in rows]
+
+    def done(self, entries, calls=0):
+        """
+        書き込めた行を消す (書き込み中に再度 enqueue された行は rev が違うので残る)。
+        calls (その行を送った同期の API 呼び出し回数) を synced に残す
+        """
+        with self._lock, self._connect() as con:
+            con.executemany(
+                "DELETE FROM pending WHERE sheet = ? AND date = ? AND rev = ?",
+                [(e.sheet, e.date, e.rev) for e in entries],
+            )
+            con.executemany(
+                "INSERT INTO synced (sheet, date, rev, calls) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (sheet, date) DO UPDATE SET rev = excluded.rev, calls = excluded.calls WHERE excluded.rev > rev",
+                [(e.sheet, e.date, e.rev, calls) for e in entries],
+            )
+
+    def rev(self, sheet, date):
+        """(sheet, date) の最新の rev (未同期ならキューの rev、同期済みなら最後に書けた rev。どちらもなければ None)"""
+        with self._lock, self._connect() as con:
+            found = con.execute("SELECT rev FROM pending WHERE sheet = ? AND date = ?", (sheet, date)).fetchone() \
+                or con.execute("SELECT rev FROM synced WHERE sheet = ? AND date = ?", (sheet, date)).fetchone()
+        return found[0] if found else None
+
+    def version(self, sheet):
+        """sheet の行が Sheets に書けるたびに増える数 (読み出しのキャッシュが古くなったかの判定用。別プロセスの同期も数える)"""
+        with self._lock, self._connect() as con:
+            return con.execute("SELECT COALESCE(SUM(rev), 0) FROM synced WHERE sheet = ?", (sheet,)).fetchone()[0]
+
+    def synced_calls(self, sheet, date, rev):
+        """rev 以降の (sheet, date) の行が Sheets に書けていれば、その同期の API 呼び出し回数。まだなら None"""
+        with self._lock, self._connect() as con:
+            found = con.execute(
+                "SELECT calls FROM synced WHERE sheet = ? AND date = ? AND rev >= ?", (sheet, date, rev)
+            ).fetchone()
+        return found[0] if found else None
+
+    def retry_later(self, entries, error, base_delay=2.0, max_delay=600.0):
+        """失敗した行を指数バックオフ (ジッター付き) で再送待ちにする"""
+        now = time.time()
+        with self._lock, self._connect() as con:
+            con.executemany(
+                "UPDATE pending SET attempts = attempts + 1, next_try = ?, last_error = ? "
+                "WHERE sheet = ? AND date = ? AND rev = ?",
+                [
+                    (now + random.uniform(0.5, 1.0) * min(max_delay, base_delay * 2 ** e.attempts),
+                     str(error), e.sheet, e.date, e.rev)
+                    for e in entries
+                ],
+            )
+
+    def stats(self):
+        """(未同期の件数, 最後のエラー) を返す"""
+        with self._lock, self._connect() as con:
+            count = con.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+            err = con.execute(
+                "SELECT last_error FROM pending WHERE last_error IS NOT NULL ORDER BY attempts DESC LIMIT 1"
+            ).fetchone()
+        return count, err[0] if err else None
+
+
+class FlushWorker(threading.Thread):
+    """
+    WriteQueue を Google Sheets に書き出すデーモンスレッド。
+    pool は sheet(title) / index(title) を持つもの (sheets_io.SheetPool)。
+    1回の flush では (シート, value_input_option) ごとに、既存行の上書きと新しい行の追加を
+    まとめて1回の batch_update で送る。行番号は SheetPool の RowIndex から引くので、
+    同じ日付を何度送っても同じ行を上書きするだけになる。
+    """
+
+    def __init__(self, queue, pool, interval=5.0, batch_window=0.5, base_delay=2.0, max_delay=600.0):
+        super().__init__(daemon=True, name="sheets-flush")
+        self.queue = queue
+        self.pool = pool
+        self.interval = interval
+        self.batch_window = batch_window
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.last_calls = 0
+        self.last_error = None
+        self._wake = threading.Event()
+
+    def notify(self):
+        """enqueue 直後に呼ぶと、ポーリングを待たずに同期を始める"""
+        self._wake.set()
+
+    def run(self):
+        while True:
+            if self._wake.wait(self.interval):
+                time.sleep(self.batch_window)  # 連続した保存をまとめて送る
+            self._wake.clear()
+            try:
+                self.flush_once()
+            except Exception as e:  # スレッドは止めない
+                self.last_error = e
+
+    def flush_once(self):
+        """再送待ちでない行をすべて書き出す。書き込めた行数を返す"""
+        groups = {}
+        for e in self.queue.due():
+            groups.setdefault((e.sheet, e.value_input_option), []).append(e)
+        written, calls = 0, 0
+        for (title, value_input_option), entries in groups.items():
+            sheet = None
+            try:
+                # バックオフ後の再送は、トレースの retry に何回目かを残す
+                sheet = CountingSheet(self.pool.sheet(title, retry=max(e.attempts for e in entries)))
+                self._write_group(sheet, title, value_input_option, entries)
+                self.queue.done(entries, sheet.calls)
+                written += len(entries)
+                self.last_error = None
+            except Exception as e:
+                self.pool.index(title).invalidate()
+                self.queue.retry_later(entries, e, self.base_delay, self.max_delay)
+                self.last_error = e
+            calls += sheet.calls if sheet else 0
+        if groups: self.last_calls = calls  # 送る行がなかったポーリングでは前回の値を残す
+        return written
+
+    def _write_group(self, sheet, title, value_input_option, entries):
+        upsert_by_date(sheet, self.pool.index(title), [e.row for e in entries], value_input_option)
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def start_worker(queue, pool, **kwargs):
+    """キューファイルごとに FlushWorker を1つだけ起動する (両アプリ・全セッションで共有)"""
+    with _workers_lock:
+        worker = _workers.get(queue.path)
+        if worker is None or not worker.is_alive():
+            worker = _workers[queue.path] = FlushWorker(queue, pool, **kwargs)
+            worker.start()
+        return worker